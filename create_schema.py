@@ -1,27 +1,51 @@
 # create_schema.py
-# Creates the SQLite DB file trust_engine.db and the required schema + triggers.
-# Rewritten to avoid "AFTER INSERT OR UPDATE" single-trigger syntax which caused the
-# "near 'OR': syntax error" on some SQLite builds. Uses two explicit triggers.
+# Creates the SQLite DB file trust_engine.db and the required schema.
+# Trust scores used to be computed by two AFTER INSERT/UPDATE triggers; that work now
+# happens in Python (see db_upsert.upsert_user) and the old triggers are dropped.
 
-import sqlite3
 import os
 
+from db_upsert import open_conn
+
 DB_FILE = "trust_engine.db"
 
-SQL = """
-PRAGMA foreign_keys = ON;
+# The score-computing triggers of the old schema; SQL drops them.
+LEGACY_TRIGGERS = ("trg_compute_trust_on_user_insert", "trg_compute_trust_on_user_update")
+
+# Stored in PRAGMA user_version once SQL has been applied; bump it whenever SQL changes
+# so existing databases pick the change up. Databases from before versioning (including
+# the old trigger-based schema) report 0.
+CURRENT_SCHEMA_VERSION = 7
+
+# recompute_jobs.enqueued_at is unix seconds, but producers written for the old text
+# schema (e.g. create_recompute.py's enqueue triggers) may still insert datetime('now')
+# text. Rewrite any non-integer value right after the insert; text that isn't a date
+# becomes the insert time.
+_ENQUEUED_AT_UNIX = """CASE WHEN typeof(enqueued_at) = 'real' THEN CAST(enqueued_at AS INTEGER)
+    ELSE coalesce(CAST(strftime('%s', enqueued_at) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER)) END"""
+
+ENQUEUED_AT_TRIGGER = f"""
+CREATE TRIGGER IF NOT EXISTS trg_recompute_jobs_enqueued_at_unix
+AFTER INSERT ON recompute_jobs
+WHEN typeof(NEW.enqueued_at) <> 'integer'
+BEGIN
+  UPDATE recompute_jobs SET enqueued_at = {_ENQUEUED_AT_UNIX}
+  WHERE id = NEW.id;
+END;
+"""
 
+SQL = """
 -- USERS table
 CREATE TABLE IF NOT EXISTS users (
   user_id TEXT PRIMARY KEY,
-  photos INTEGER DEFAULT 0,
-  bio_filled INTEGER DEFAULT 0,
-  interests_count INTEGER DEFAULT 0,
-  selfie_verified INTEGER DEFAULT 0,
-  id_verified INTEGER DEFAULT 0,
-  login_streak INTEGER DEFAULT 0,
-  response_rate_pct INTEGER DEFAULT 0,
-  reports_count INTEGER DEFAULT 0,
+  photos INTEGER NOT NULL DEFAULT 0,
+  bio_filled INTEGER NOT NULL DEFAULT 0,
+  interests_count INTEGER NOT NULL DEFAULT 0,
+  selfie_verified INTEGER NOT NULL DEFAULT 0,
+  id_verified INTEGER NOT NULL DEFAULT 0,
+  login_streak INTEGER NOT NULL DEFAULT 0,
+  response_rate_pct INTEGER NOT NULL DEFAULT 0,
+  reports_count INTEGER NOT NULL DEFAULT 0,
   last_active_at TEXT,
   updated_at TEXT DEFAULT (datetime('now'))
 );
@@ -38,131 +62,206 @@ CREATE TABLE IF NOT EXISTS trust_score_audit (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   user_id TEXT REFERENCES users(user_id) ON DELETE CASCADE,
   new_score NUMERIC(6,2),
-  details TEXT,
-  computed_at TEXT DEFAULT (datetime('now'))
+  details TEXT,                                -- JSON text, or a BLOB per details_codec
+  computed_at TEXT DEFAULT (datetime('now')),
+  details_codec TEXT NOT NULL DEFAULT 'json'   -- 'json' | 'zstd' (zstd-compressed JSON)
 );
 
--- Remove any old triggers with these names (safe if they don't exist)
-DROP TRIGGER IF EXISTS trg_compute_trust_on_user_insert;
-DROP TRIGGER IF EXISTS trg_compute_trust_on_user_update;
+-- RECOMPUTE JOBS queue, consumed by worker_debug.py (and read by db_upsert._find_latest_job)
+CREATE TABLE IF NOT EXISTS recompute_jobs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id TEXT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+  processing INTEGER NOT NULL DEFAULT 0,
+  processed INTEGER NOT NULL DEFAULT 0,  -- 0 = pending, 1 = done, 2 = failed
+  processor TEXT,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  enqueued_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),  -- unix seconds
+  processed_at INTEGER,                                                          -- unix seconds
+  last_error TEXT
+);
 
--- Trigger BODY SQL as a reusable statement block (we'll inline it into both triggers)
--- Note: SQLite requires each statement inside BEGIN...END to end with a semicolon.
--- This trigger computes score and inserts/updates trust_scores and appends an audit row.
+-- Indexes for the per-user "latest first" reads in db_upsert (get_audit_rows, _find_latest_job)
+CREATE INDEX IF NOT EXISTS idx_audit_user_time ON trust_score_audit(user_id, computed_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_jobs_user_enq ON recompute_jobs(user_id, enqueued_at DESC, id DESC);
 
--- INSERT trigger
-CREATE TRIGGER trg_compute_trust_on_user_insert
-AFTER INSERT ON users
-FOR EACH ROW
-BEGIN
-  INSERT OR REPLACE INTO trust_scores(user_id, score, updated_at)
-  VALUES (
-    NEW.user_id,
-    (
-      -- PROFILE (0..30)
-      (
-        (CASE WHEN ((NEW.photos * 1.0) / 6.0) < 1.0 THEN ((NEW.photos * 1.0) / 6.0) ELSE 1.0 END) * 15.0
-        + (CASE WHEN NEW.bio_filled = 1 THEN 10.0 ELSE 0.0 END)
-        + (CASE WHEN ((NEW.interests_count * 1.0) / 5.0) < 1.0 THEN ((NEW.interests_count * 1.0) / 5.0) ELSE 1.0 END) * 5.0
-      )
-      -- VERIFICATION (0..40)
-      + (CASE WHEN NEW.selfie_verified = 1 THEN 20.0 ELSE 0.0 END)
-      + (CASE WHEN NEW.id_verified = 1 THEN 20.0 ELSE 0.0 END)
-      -- ACTIVITY (0..30)
-      + (CASE WHEN NEW.login_streak < 10 THEN NEW.login_streak ELSE 10 END) * 1.0
-      + (CASE WHEN ((NEW.response_rate_pct * 1.0) / 10.0) < 10.0 THEN ((NEW.response_rate_pct * 1.0) / 10.0) ELSE 10.0 END)
-      + (CASE WHEN (NEW.reports_count * -2.0) < -10.0 THEN -10.0 ELSE (NEW.reports_count * -2.0) END)
-    ),
-    datetime('now')
-  );
-
-  INSERT INTO trust_score_audit(user_id, new_score, details, computed_at)
-  VALUES (
-    NEW.user_id,
-    (SELECT score FROM trust_scores WHERE user_id = NEW.user_id LIMIT 1),
-    json_object(
-      'photos', NEW.photos,
-      'photos_score', (CASE WHEN ((NEW.photos * 1.0) / 6.0) < 1.0 THEN ((NEW.photos * 1.0) / 6.0) ELSE 1.0 END) * 15.0,
-      'bio_filled', NEW.bio_filled,
-      'bio_score', (CASE WHEN NEW.bio_filled = 1 THEN 10.0 ELSE 0.0 END),
-      'interests_count', NEW.interests_count,
-      'interests_score', (CASE WHEN ((NEW.interests_count * 1.0) / 5.0) < 1.0 THEN ((NEW.interests_count * 1.0) / 5.0) ELSE 1.0 END) * 5.0,
-      'selfie_verified', NEW.selfie_verified,
-      'id_verified', NEW.id_verified,
-      'verification_score', ((CASE WHEN NEW.selfie_verified = 1 THEN 20.0 ELSE 0.0 END) + (CASE WHEN NEW.id_verified = 1 THEN 20.0 ELSE 0.0 END)),
-      'login_streak', NEW.login_streak,
-      'login_streak_score', (CASE WHEN NEW.login_streak < 10 THEN NEW.login_streak ELSE 10 END),
-      'response_rate_pct', NEW.response_rate_pct,
-      'response_rate_score', (CASE WHEN ((NEW.response_rate_pct * 1.0) / 10.0) < 10.0 THEN ((NEW.response_rate_pct * 1.0) / 10.0) ELSE 10.0 END),
-      'reports_count', NEW.reports_count,
-      'reports_penalty', (CASE WHEN (NEW.reports_count * -2.0) < -10.0 THEN -10.0 ELSE (NEW.reports_count * -2.0) END)
-    ),
-    datetime('now')
-  );
-END;
+-- Pending jobs only, in claim order (worker_debug.claim_job); done/failed rows drop out
+CREATE INDEX IF NOT EXISTS idx_rj_pending ON recompute_jobs(processed, processing, enqueued_at)
+  WHERE processed = 0 AND processing = 0;
+""" + ENQUEUED_AT_TRIGGER + """
+-- Scores are computed in Python (trust_score.compute_trust_score) and written by
+-- db_upsert alongside the user row, so no compute triggers are created. Drop the
+-- ones older versions of this script installed (safe if they don't exist).
+DROP TRIGGER IF EXISTS trg_compute_trust_on_user_insert;
+DROP TRIGGER IF EXISTS trg_compute_trust_on_user_update;
+"""
 
--- UPDATE trigger (same body)
-CREATE TRIGGER trg_compute_trust_on_user_update
-AFTER UPDATE ON users
-FOR EACH ROW
-BEGIN
-  INSERT OR REPLACE INTO trust_scores(user_id, score, updated_at)
-  VALUES (
-    NEW.user_id,
-    (
-      (CASE WHEN ((NEW.photos * 1.0) / 6.0) < 1.0 THEN ((NEW.photos * 1.0) / 6.0) ELSE 1.0 END) * 15.0
-      + (CASE WHEN NEW.bio_filled = 1 THEN 10.0 ELSE 0.0 END)
-      + (CASE WHEN ((NEW.interests_count * 1.0) / 5.0) < 1.0 THEN ((NEW.interests_count * 1.0) / 5.0) ELSE 1.0 END) * 5.0
-      + (CASE WHEN NEW.selfie_verified = 1 THEN 20.0 ELSE 0.0 END)
-      + (CASE WHEN NEW.id_verified = 1 THEN 20.0 ELSE 0.0 END)
-      + (CASE WHEN NEW.login_streak < 10 THEN NEW.login_streak ELSE 10 END) * 1.0
-      + (CASE WHEN ((NEW.response_rate_pct * 1.0) / 10.0) < 10.0 THEN ((NEW.response_rate_pct * 1.0) / 10.0) ELSE 10.0 END)
-      + (CASE WHEN (NEW.reports_count * -2.0) < -10.0 THEN -10.0 ELSE (NEW.reports_count * -2.0) END)
-    ),
-    datetime('now')
-  );
-
-  INSERT INTO trust_score_audit(user_id, new_score, details, computed_at)
-  VALUES (
-    NEW.user_id,
-    (SELECT score FROM trust_scores WHERE user_id = NEW.user_id LIMIT 1),
-    json_object(
-      'photos', NEW.photos,
-      'photos_score', (CASE WHEN ((NEW.photos * 1.0) / 6.0) < 1.0 THEN ((NEW.photos * 1.0) / 6.0) ELSE 1.0 END) * 15.0,
-      'bio_filled', NEW.bio_filled,
-      'bio_score', (CASE WHEN NEW.bio_filled = 1 THEN 10.0 ELSE 0.0 END),
-      'interests_count', NEW.interests_count,
-      'interests_score', (CASE WHEN ((NEW.interests_count * 1.0) / 5.0) < 1.0 THEN ((NEW.interests_count * 1.0) / 5.0) ELSE 1.0 END) * 5.0,
-      'selfie_verified', NEW.selfie_verified,
-      'id_verified', NEW.id_verified,
-      'verification_score', ((CASE WHEN NEW.selfie_verified = 1 THEN 20.0 ELSE 0.0 END) + (CASE WHEN NEW.id_verified = 1 THEN 20.0 ELSE 0.0 END)),
-      'login_streak', NEW.login_streak,
-      'login_streak_score', (CASE WHEN NEW.login_streak < 10 THEN NEW.login_streak ELSE 10 END),
-      'response_rate_pct', NEW.response_rate_pct,
-      'response_rate_score', (CASE WHEN ((NEW.response_rate_pct * 1.0) / 10.0) < 10.0 THEN ((NEW.response_rate_pct * 1.0) / 10.0) ELSE 10.0 END),
-      'reports_count', NEW.reports_count,
-      'reports_penalty', (CASE WHEN (NEW.reports_count * -2.0) < -10.0 THEN -10.0 ELSE (NEW.reports_count * -2.0) END)
-    ),
-    datetime('now')
-  );
-END;
+# Scores written by the old triggers used a different formula than trust_score.py.
+# Recompute every user's score with the engine via the trust_compute() SQL function
+# that db_upsert.open_conn registers. Only run when upgrading a pre-versioning (v0)
+# database: later schemas only ever hold engine-computed scores, and a rescore would
+# overwrite them with freshly decayed values without writing audit rows.
+# trust_compute() is NULL for rows the engine can't score (the old schema accepted any
+# last_active_at text); those keep their old score and main() reports their user_ids
+# from temp.rescore.
+RESCORE_SQL = """
+CREATE TEMP TABLE rescore AS
+SELECT user_id,
+       trust_compute(photos, bio_filled, interests_count, selfie_verified, id_verified,
+                     login_streak, response_rate_pct, reports_count, last_active_at) AS score
+FROM users;
+INSERT INTO trust_scores (user_id, score, updated_at)
+SELECT user_id, score, datetime('now')
+FROM temp.rescore WHERE score IS NOT NULL
+ON CONFLICT(user_id) DO UPDATE SET
+  score = excluded.score,
+  updated_at = excluded.updated_at;
 """
 
+# Steps for databases that already exist at an older version, as (version, sql): each
+# runs (after SQL, inside the same transaction) when the DB's user_version is below
+# `version`. Steps must be safe on tables SQL has just created in the current shape
+# (tables added after the first schema); tables every older schema had may be ALTERed.
+MIGRATIONS = [
+    # v4: recompute_jobs.enqueued_at / processed_at change from datetime('now') text to
+    # unix seconds, so job latency is a plain integer subtraction (worker_debug.py).
+    # SQLite can't change a column's type in place, so rebuild the table. Text that
+    # isn't a date becomes the upgrade time (enqueued_at) or NULL (processed_at).
+    (4, """
+CREATE TABLE recompute_jobs_v4 (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id TEXT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+  processing INTEGER NOT NULL DEFAULT 0,
+  processed INTEGER NOT NULL DEFAULT 0,
+  processor TEXT,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  enqueued_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+  processed_at INTEGER,
+  last_error TEXT
+);
+INSERT INTO recompute_jobs_v4
+SELECT id, user_id, processing, processed, processor, attempts,
+       CASE WHEN typeof(enqueued_at) = 'text'
+            THEN coalesce(CAST(strftime('%s', enqueued_at) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER))
+            ELSE coalesce(enqueued_at, 0) END,
+       CASE WHEN typeof(processed_at) = 'text' THEN CAST(strftime('%s', processed_at) AS INTEGER)
+            ELSE processed_at END,
+       last_error
+FROM recompute_jobs;
+DROP TABLE recompute_jobs;
+ALTER TABLE recompute_jobs_v4 RENAME TO recompute_jobs;
+CREATE INDEX IF NOT EXISTS idx_jobs_user_enq ON recompute_jobs(user_id, enqueued_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_rj_pending ON recompute_jobs(processed, processing, enqueued_at)
+  WHERE processed = 0 AND processing = 0;
+"""),
+    # v5: the users counters/flags become NOT NULL DEFAULT 0 (old NULLs read as 0), so
+    # readers can use the row values as-is. Rebuilt like v4; main() turns foreign keys
+    # off around the migration so dropping the old users table doesn't cascade-delete
+    # scores, audits and jobs, and recreates the triggers on users the DROP removes.
+    (5, """
+CREATE TABLE users_v5 (
+  user_id TEXT PRIMARY KEY,
+  photos INTEGER NOT NULL DEFAULT 0,
+  bio_filled INTEGER NOT NULL DEFAULT 0,
+  interests_count INTEGER NOT NULL DEFAULT 0,
+  selfie_verified INTEGER NOT NULL DEFAULT 0,
+  id_verified INTEGER NOT NULL DEFAULT 0,
+  login_streak INTEGER NOT NULL DEFAULT 0,
+  response_rate_pct INTEGER NOT NULL DEFAULT 0,
+  reports_count INTEGER NOT NULL DEFAULT 0,
+  last_active_at TEXT,
+  updated_at TEXT DEFAULT (datetime('now'))
+);
+INSERT INTO users_v5
+SELECT user_id,
+       coalesce(photos, 0),
+       coalesce(bio_filled, 0),
+       coalesce(interests_count, 0),
+       coalesce(selfie_verified, 0),
+       coalesce(id_verified, 0),
+       coalesce(login_streak, 0),
+       coalesce(response_rate_pct, 0),
+       coalesce(reports_count, 0),
+       last_active_at, updated_at
+FROM users;
+DROP TABLE users;
+ALTER TABLE users_v5 RENAME TO users;
+"""),
+    # v6: audit details may be stored compressed (worker_debug.py); the codec column says
+    # how to read each row. Existing rows are plain JSON text. The details column is
+    # left declared TEXT: SQLite stores BLOB values in it unchanged.
+    (6, """
+ALTER TABLE trust_score_audit ADD COLUMN details_codec TEXT NOT NULL DEFAULT 'json';
+"""),
+    # v7: rows that old-style producers wrote with text timestamps after v4 are converted,
+    # and ENQUEUED_AT_TRIGGER keeps new ones integer (a v4 rebuild in this same upgrade
+    # drops the copy SQL created on the old table, hence the CREATE here too).
+    (7, f"""
+UPDATE recompute_jobs SET enqueued_at = {_ENQUEUED_AT_UNIX}
+WHERE typeof(enqueued_at) <> 'integer';
+UPDATE recompute_jobs
+SET processed_at = CASE WHEN typeof(processed_at) = 'real' THEN CAST(processed_at AS INTEGER)
+                        ELSE CAST(strftime('%s', processed_at) AS INTEGER) END
+WHERE typeof(processed_at) NOT IN ('integer', 'null');
+""" + ENQUEUED_AT_TRIGGER),
+]
+
 def main():
     creating = not os.path.exists(DB_FILE)
-    if creating:
-        print(f"[info] creating {DB_FILE}")
-    else:
-        print(f"[info] {DB_FILE} exists — applying schema and trigger changes (DROP/CREATE).")
 
-    conn = sqlite3.connect(DB_FILE)
-    conn.execute("PRAGMA foreign_keys = ON;")
+    conn = open_conn(DB_FILE)
     try:
-        conn.executescript(SQL)
-        conn.commit()
+        # an existing but empty file (no users table) is created from scratch too
+        creating = creating or conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'users'").fetchone() is None
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= CURRENT_SCHEMA_VERSION:
+            print(f"[info] {DB_FILE} is already at schema version {version} — nothing to do.")
+            return
+        if creating:
+            print(f"[info] creating {DB_FILE}")
+        else:
+            print(f"[info] {DB_FILE} exists (schema version {version}) — applying schema changes.")
+
+        migrations = "" if creating else "".join(m for v, m in MIGRATIONS if version < v)
+        if migrations:
+            # Table rebuilds break triggers: DROP TABLE users takes the triggers on users
+            # with it, and the rename back to recompute_jobs fails while any trigger still
+            # refers to the dropped table. Drop every trigger first and recreate it from
+            # its saved SQL afterwards (the legacy ones SQL drops are left dropped).
+            triggers = conn.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name NOT IN (?, ?)",
+                LEGACY_TRIGGERS,
+            ).fetchall()
+            migrations = (
+                "".join(f'DROP TRIGGER IF EXISTS "{name}";\n' for name, _ in triggers)
+                + migrations
+                + "".join(f"{sql};\n" for _, sql in triggers)
+            )
+        rescore = RESCORE_SQL if version == 0 and not creating else ""
+
+        # Table rebuilds drop and recreate users; with foreign keys on, that DROP would
+        # cascade to every child row. The pragma is a no-op inside a transaction, so it
+        # is switched before BEGIN (the rebuilds keep every user_id, so no FK breaks).
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            # one transaction: schema, migrations, rescore and the version bump land together or not at all
+            conn.executescript(
+                "BEGIN IMMEDIATE;\n"
+                + SQL
+                + migrations
+                + rescore
+                + f"PRAGMA user_version = {CURRENT_SCHEMA_VERSION};\n"
+                + "COMMIT;"
+            )
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+        if rescore:
+            unscored = [r[0] for r in conn.execute("SELECT user_id FROM temp.rescore WHERE score IS NULL")]
+            if unscored:
+                print(f"[warn] could not rescore {len(unscored)} user(s) (kept their old score):", ", ".join(unscored))
+            conn.execute("DROP TABLE temp.rescore")
     finally:
         conn.close()
-    print("[done] schema + triggers created in", DB_FILE)
+    print(f"[done] schema version {CURRENT_SCHEMA_VERSION} applied to", DB_FILE)
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,55 @@
 # db_upsert.py
 # Provides upsert_user(conn, user_dict) and upsert_user_and_wait(conn, user_dict, timeout=15)
+# upsert_user does not commit — wrap it in your own transaction (BEGIN IMMEDIATE ... commit),
+# or use upsert_user_and_wait / upsert_users_bulk, which commit for you.
 # Usage:
-#   from db_upsert import upsert_user_and_wait, DB_FILE
-#   conn = sqlite3.connect(DB_FILE); conn.execute("PRAGMA foreign_keys=ON;")
-#   upsert_user_and_wait(conn, user_json, timeout=15)
+#   from db_upsert import upsert_user_and_wait, open_conn, DB_FILE
+#   conn = open_conn(DB_FILE)
+#   upsert_user_and_wait(conn, user_json, timeout=15)   # timeout = max wait for the write lock
 #   conn.close()
 
+import json
+import os
 import sqlite3
-import time
-from typing import Dict, Any, Optional
+from itertools import islice
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+from trust_score import TrustScoreResult, compute_trust_score
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed to read zstd-compressed audit details
+    zstandard = None
 
 DB_FILE = "trust_engine.db"
 
+# Connection tuning applied by open_conn(). WAL lets readers (e.g. the wait/poll path)
+# run alongside a writer, and synchronous=NORMAL drops the fsync from every commit
+# (the WAL is still synced at checkpoint). The -wal/-shm files live next to the DB file.
+PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+PRAGMA mmap_size = 268435456;
+PRAGMA busy_timeout = 5000;
+PRAGMA foreign_keys = ON;
+"""
+
+# sqlite3's per-connection prepared-statement cache (default 100); the module's SQL
+# lives in _SQL_* constants so every call hits the same cached statement
+CACHED_STATEMENTS = 256
+
+def open_conn(path: str = DB_FILE) -> sqlite3.Connection:
+    """
+    Open a connection to `path` with the tuned PRAGMAs applied.
+    """
+    conn = sqlite3.connect(path, cached_statements=CACHED_STATEMENTS)
+    conn.executescript(PRAGMAS)
+    # not deterministic=True: the score's inactivity decay depends on the current time
+    conn.create_function("trust_compute", 9, _score_from_cols)
+    return conn
+
 def map_input_to_row(d: Dict[str, Any]) -> Dict[str, Any]:
     interests_val = d.get("interests")
     if isinstance(interests_val, bool):
@@ -34,62 +72,290 @@ def map_input_to_row(d: Dict[str, Any]) -> Dict[str, Any]:
         "last_active_at": d.get("last_active_at")
     }
 
-def upsert_user(conn: sqlite3.Connection, user_json: Dict[str, Any]) -> None:
+def row_to_engine_input(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Inverse of map_input_to_row: the dict compute_trust_score expects, built from a users row.
+    Scoring the stored row (rather than the raw input) keeps trust_scores consistent with users.
+    """
+    return {
+        "user_id": row["user_id"],
+        "photos": row["photos"],
+        "bio": bool(row["bio_filled"]),
+        "interests": row["interests_count"],
+        "selfie_verified": bool(row["selfie_verified"]),
+        "id_verified": bool(row["id_verified"]),
+        "login_streak_days": row["login_streak"],
+        "response_rate_pct": row["response_rate_pct"],
+        "reports_received": row["reports_count"],
+        "last_active_at": row["last_active_at"],
+    }
+
+def _score_from_cols(photos, bio_filled, interests_count, selfie_verified, id_verified,
+                     login_streak, response_rate_pct, reports_count, last_active_at) -> Optional[float]:
+    """
+    SQL scalar function trust_compute(<users columns>): the engine's final score for a users row.
+    Registered on every connection from open_conn, so SQL-side rescoring (e.g. in create_schema)
+    uses the same formula as upsert_user instead of a hand-written CASE expression.
+    Returns NULL for a row the engine rejects (e.g. a last_active_at that isn't ISO 8601),
+    rather than failing the whole statement.
+    """
+    user = row_to_engine_input({
+        "user_id": None,
+        "photos": photos or 0,
+        "bio_filled": bio_filled,
+        "interests_count": interests_count or 0,
+        "selfie_verified": selfie_verified,
+        "id_verified": id_verified,
+        "login_streak": login_streak or 0,
+        "response_rate_pct": response_rate_pct or 0,
+        "reports_count": reports_count or 0,
+        "last_active_at": last_active_at,
+    })
+    try:
+        return compute_trust_score(user).final_score
+    except ValueError:
+        return None
+
+def _audit_details_json(result: TrustScoreResult) -> str:
+    """
+    Audit payload for one computed score: the component scores and breakdown the engine
+    already produced (user_id and final score have their own columns), as compact JSON.
+    """
+    details = {
+        "profile_score": result.profile_score,
+        "verification_score": result.verification_score,
+        "activity_score": result.activity_score,
+        "raw_total": result.raw_total,
+        "decay_applied": result.decay_applied,
+        "badges": result.badges,
+        **result.breakdown,
+    }
+    return json.dumps(details, separators=(",", ":"))
+
+def _score_rows(user_json: Dict[str, Any]) -> Tuple[Dict[str, Any], Tuple[str, float], Tuple[str, float, str]]:
     """
-    Insert or update a user row. The DB trigger (enqueue trigger) will create a recompute job.
+    Map one input user to the parameters for the users, trust_scores and audit statements.
     """
     row = map_input_to_row(user_json)
-    sql = """
-    INSERT INTO users (
-      user_id, photos, bio_filled, interests_count,
-      selfie_verified, id_verified,
-      login_streak, response_rate_pct, reports_count, last_active_at, updated_at
-    )
-    VALUES (
-      :user_id, :photos, :bio_filled, :interests_count,
-      :selfie_verified, :id_verified,
-      :login_streak, :response_rate_pct, :reports_count, :last_active_at, datetime('now')
-    )
-    ON CONFLICT(user_id) DO UPDATE SET
-      photos = excluded.photos,
-      bio_filled = excluded.bio_filled,
-      interests_count = excluded.interests_count,
-      selfie_verified = excluded.selfie_verified,
-      id_verified = excluded.id_verified,
-      login_streak = excluded.login_streak,
-      response_rate_pct = excluded.response_rate_pct,
-      reports_count = excluded.reports_count,
-      last_active_at = excluded.last_active_at,
-      updated_at = datetime('now')
-    ;
-    """
-    cur = conn.cursor()
-    cur.execute(sql, row)
-    conn.commit()
+    result = compute_trust_score(row_to_engine_input(row))
+    details_json = _audit_details_json(result)
+    return row, (row["user_id"], result.final_score), (row["user_id"], result.final_score, details_json)
+
+_SQL_UPSERT = """
+INSERT INTO users (
+  user_id, photos, bio_filled, interests_count,
+  selfie_verified, id_verified,
+  login_streak, response_rate_pct, reports_count, last_active_at, updated_at
+)
+VALUES (
+  :user_id, :photos, :bio_filled, :interests_count,
+  :selfie_verified, :id_verified,
+  :login_streak, :response_rate_pct, :reports_count, :last_active_at, datetime('now')
+)
+ON CONFLICT(user_id) DO UPDATE SET
+  photos = excluded.photos,
+  bio_filled = excluded.bio_filled,
+  interests_count = excluded.interests_count,
+  selfie_verified = excluded.selfie_verified,
+  id_verified = excluded.id_verified,
+  login_streak = excluded.login_streak,
+  response_rate_pct = excluded.response_rate_pct,
+  reports_count = excluded.reports_count,
+  last_active_at = excluded.last_active_at,
+  updated_at = datetime('now')
+;
+"""
+
+_SQL_UPSERT_SCORE = """
+INSERT INTO trust_scores (user_id, score, updated_at)
+VALUES (?, ?, datetime('now'))
+ON CONFLICT(user_id) DO UPDATE SET
+  score = excluded.score,
+  updated_at = excluded.updated_at
+;
+"""
+
+_SQL_INSERT_AUDIT = """
+INSERT INTO trust_score_audit (user_id, new_score, details, computed_at)
+VALUES (?, ?, ?, datetime('now'));
+"""
+
+def upsert_user(conn: sqlite3.Connection, user_json: Dict[str, Any]) -> None:
+    """
+    Insert or update a user row, compute its trust score and write trust_scores + an audit row.
+    Does not commit — the caller owns the transaction (see upsert_user_and_wait / upsert_users_bulk),
+    so all three writes land atomically.
+    """
+    row, score_row, audit_row = _score_rows(user_json)
+    conn.execute(_SQL_UPSERT, row)
+    conn.execute(_SQL_UPSERT_SCORE, score_row)
+    conn.execute(_SQL_INSERT_AUDIT, audit_row)
+
+def upsert_users_bulk(conn: sqlite3.Connection, users: Iterable[Dict[str, Any]], chunk: int = 1000) -> int:
+    """
+    Upsert many users (and their scores + audit rows) with one executemany per table
+    and one commit per `chunk` users.
+    Chunking bounds how much a single transaction adds to the WAL on very large inputs.
+    Returns the number of rows written.
+    """
+    total = 0
+    it = iter(users)
+    while True:
+        batch = [_score_rows(d) for d in islice(it, chunk)]
+        if not batch:
+            break
+        rows, score_rows, audit_rows = zip(*batch)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(_SQL_UPSERT, rows)
+            conn.executemany(_SQL_UPSERT_SCORE, score_rows)
+            conn.executemany(_SQL_INSERT_AUDIT, audit_rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        total += len(batch)
+    return total
+
+# Staging schema for bulk_ingest: plain tables (no keys/indexes/FKs) in an attached :memory: DB
+_SQL_STAGE_SCHEMA = """
+CREATE TABLE stage.users (
+  user_id TEXT, photos INTEGER, bio_filled INTEGER, interests_count INTEGER,
+  selfie_verified INTEGER, id_verified INTEGER,
+  login_streak INTEGER, response_rate_pct INTEGER, reports_count INTEGER, last_active_at TEXT
+);
+CREATE TABLE stage.trust_scores (user_id TEXT, score REAL);
+CREATE TABLE stage.trust_score_audit (user_id TEXT, new_score REAL, details TEXT);
+"""
+
+_SQL_STAGE_USER = """
+INSERT INTO stage.users VALUES (
+  :user_id, :photos, :bio_filled, :interests_count,
+  :selfie_verified, :id_verified,
+  :login_streak, :response_rate_pct, :reports_count, :last_active_at
+);
+"""
+
+_SQL_STAGE_SCORE = "INSERT INTO stage.trust_scores VALUES (?, ?);"
+
+_SQL_STAGE_AUDIT = "INSERT INTO stage.trust_score_audit VALUES (?, ?, ?);"
+
+# `WHERE true` keeps SQLite from parsing ON CONFLICT as part of the SELECT's join
+_SQL_MERGE_STAGE_USERS = """
+INSERT INTO users (
+  user_id, photos, bio_filled, interests_count,
+  selfie_verified, id_verified,
+  login_streak, response_rate_pct, reports_count, last_active_at, updated_at
+)
+SELECT user_id, photos, bio_filled, interests_count,
+       selfie_verified, id_verified,
+       login_streak, response_rate_pct, reports_count, last_active_at, datetime('now')
+FROM stage.users WHERE true
+ON CONFLICT(user_id) DO UPDATE SET
+  photos = excluded.photos,
+  bio_filled = excluded.bio_filled,
+  interests_count = excluded.interests_count,
+  selfie_verified = excluded.selfie_verified,
+  id_verified = excluded.id_verified,
+  login_streak = excluded.login_streak,
+  response_rate_pct = excluded.response_rate_pct,
+  reports_count = excluded.reports_count,
+  last_active_at = excluded.last_active_at,
+  updated_at = excluded.updated_at;
+"""
+
+_SQL_MERGE_STAGE_SCORES = """
+INSERT INTO trust_scores (user_id, score, updated_at)
+SELECT user_id, score, datetime('now') FROM stage.trust_scores WHERE true
+ON CONFLICT(user_id) DO UPDATE SET
+  score = excluded.score,
+  updated_at = excluded.updated_at;
+"""
+
+_SQL_MERGE_STAGE_AUDIT = """
+INSERT INTO trust_score_audit (user_id, new_score, details, computed_at)
+SELECT user_id, new_score, details, datetime('now') FROM stage.trust_score_audit;
+"""
+
+def bulk_ingest(conn: sqlite3.Connection, path_to_json: str) -> int:
+    """
+    Ingest a JSON array of users from `path_to_json` in one atomic merge.
+    Rows (with their computed scores and audit payloads) are staged in an attached
+    :memory: database, then merged into users / trust_scores / trust_score_audit with
+    INSERT ... SELECT in a single transaction, so the live tables' B-trees are touched
+    once and readers see the whole batch appear at once. Returns the number of users.
+    """
+    with open(path_to_json, "r", encoding="utf-8") as f:
+        users = json.load(f)
+    rows, score_rows, audit_rows = zip(*(_score_rows(d) for d in users)) if users else ((), (), ())
+
+    conn.execute("ATTACH DATABASE ':memory:' AS stage")
+    try:
+        conn.executescript(_SQL_STAGE_SCHEMA)
+        conn.executemany(_SQL_STAGE_USER, rows)
+        conn.executemany(_SQL_STAGE_SCORE, score_rows)
+        conn.executemany(_SQL_STAGE_AUDIT, audit_rows)
+        conn.commit()  # only the in-memory stage was written; nothing is synced to disk
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(_SQL_MERGE_STAGE_USERS)
+            conn.execute(_SQL_MERGE_STAGE_SCORES)
+            conn.execute(_SQL_MERGE_STAGE_AUDIT)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.execute("DETACH DATABASE stage")
+    return len(rows)
+
+_SQL_GET_SCORE = "SELECT user_id, score, updated_at FROM trust_scores WHERE user_id = ? LIMIT 1"
+
+_SQL_GET_AUDIT = """
+SELECT id, user_id, new_score, details, computed_at, details_codec
+FROM trust_score_audit
+WHERE user_id = ?
+ORDER BY computed_at DESC, id DESC
+LIMIT ?;
+"""
+
+# how many audit rows upsert_user_and_wait reads back
+AUDIT_ROWS_LIMIT = 50
+
+_SQL_FIND_JOB = """
+SELECT id, user_id, processing, processed, attempts, enqueued_at, processed_at, last_error
+FROM recompute_jobs
+WHERE user_id = ?
+ORDER BY enqueued_at DESC, id DESC
+LIMIT 1;
+"""
 
 def get_trust_score(conn: sqlite3.Connection, user_id: str) -> Optional[tuple]:
-    cur = conn.cursor()
-    cur.execute("SELECT user_id, score, updated_at FROM trust_scores WHERE user_id = ? LIMIT 1", (user_id,))
-    return cur.fetchone()
-
-def get_audit_rows(conn: sqlite3.Connection, user_id: str):
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, user_id, new_score, details, computed_at FROM trust_score_audit WHERE user_id = ? ORDER BY computed_at DESC",
-        (user_id,)
-    )
-    return cur.fetchall()
+    return conn.execute(_SQL_GET_SCORE, (user_id,)).fetchone()
+
+def decode_details(details: Any, codec: str) -> Optional[str]:
+    """
+    The JSON text of an audit row's details column, given its details_codec.
+    """
+    if codec == "json" or details is None:
+        return details
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("audit details are zstd-compressed; install zstandard to read them")
+        return zstandard.ZstdDecompressor().decompress(details).decode("utf-8")
+    raise ValueError(f"unknown details_codec: {codec!r}")
+
+def get_audit_rows(conn: sqlite3.Connection, user_id: str, limit: Optional[int] = None):
+    """
+    Audit rows (id, user_id, new_score, details, computed_at) for `user_id`, newest first;
+    at most `limit` rows (all when None). details is always returned as JSON text.
+    """
+    rows = conn.execute(_SQL_GET_AUDIT, (user_id, -1 if limit is None else limit))
+    return [(i, uid, score, decode_details(details, codec), at) for i, uid, score, details, at, codec in rows]
 
 def _find_latest_job(conn: sqlite3.Connection, user_id: str) -> Optional[dict]:
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, user_id, processing, processed, attempts, enqueued_at, processed_at, last_error
-        FROM recompute_jobs
-        WHERE user_id = ?
-        ORDER BY enqueued_at DESC, id DESC
-        LIMIT 1;
-    """, (user_id,))
-    r = cur.fetchone()
+    r = conn.execute(_SQL_FIND_JOB, (user_id,)).fetchone()
     if r is None:
         return None
     return {
@@ -97,51 +363,71 @@ def _find_latest_job(conn: sqlite3.Connection, user_id: str) -> Optional[dict]:
         "attempts": r[4], "enqueued_at": r[5], "processed_at": r[6], "last_error": r[7]
     }
 
-def upsert_user_and_wait(conn: sqlite3.Connection, user_json: Dict[str, Any], timeout: float = 15.0, poll_interval: float = 0.5):
+_SQL_ENQUEUE_JOB = "INSERT INTO recompute_jobs (user_id) VALUES (?);"
+
+# Workers (worker_debug.py) block on a named FIFO next to the DB file instead of
+# sleeping between polls; a producer writes one byte to it after committing new jobs.
+NOTIFY_SUFFIX = ".notify"
+
+def notify_path(db_path: str = DB_FILE) -> str:
+    return db_path + NOTIFY_SUFFIX
+
+def enqueue_recompute(conn: sqlite3.Connection, user_ids: Iterable[str]) -> None:
     """
-    Upsert the user, then wait up to `timeout` seconds for the worker to process the recompute job.
-    If no job is enqueued (because one was already pending), this function will attempt to wait for trust_scores to be updated.
-    After wait completes (success or timeout) the function prints the trust_scores row and recent audits.
+    Queue a recompute job for each user id. Does not commit — call notify_workers()
+    once the caller's transaction has committed so a waiting worker picks the jobs up.
+    """
+    conn.executemany(_SQL_ENQUEUE_JOB, ((str(u),) for u in user_ids))
+
+def notify_workers(db_path: str = DB_FILE) -> bool:
+    """
+    Wake workers waiting on `db_path`'s notify FIFO. Returns False when no worker is
+    listening (or the platform has no FIFOs); workers still find the jobs on their
+    next timed poll, so this is only a latency hint.
+    """
+    if not hasattr(os, "mkfifo"):
+        return False
+    try:
+        fd = os.open(notify_path(db_path), os.O_WRONLY | os.O_NONBLOCK)
+    except OSError:
+        # ENOENT: no FIFO yet; ENXIO: FIFO exists but no worker has it open
+        return False
+    try:
+        os.write(fd, b"\0")
+    except BlockingIOError:
+        pass  # FIFO already full of unread wakeups
+    finally:
+        os.close(fd)
+    return True
+
+def upsert_user_and_wait(conn: sqlite3.Connection, user_json: Dict[str, Any], timeout: float = 15.0):
+    """
+    Upsert the user and return its trust_scores row, audit rows and latest recompute job.
+    The score is computed and written in the same transaction as the user row, so once the
+    commit returns there is nothing left to wait for and the results are read exactly once.
+    `timeout` only caps how long the upsert may wait for a write lock held by another connection.
+    The function also prints the trust_scores row and recent audits.
     """
     user_id = str(user_json["user_id"])
-    # snapshot existing trust_score updated_at (if any)
-    before = get_trust_score(conn, user_id)
-    before_updated_at = before[2] if before else None
-
-    # perform upsert (this fires the enqueue trigger)
-    upsert_user(conn, user_json)
-
-    start = time.monotonic()
-    deadline = start + timeout
-
-    # attempt to locate the job inserted by the trigger
-    job = None
-    while time.monotonic() < deadline:
-        job = _find_latest_job(conn, user_id)
-        if job is not None:
-            # If job already processed, break immediately.
-            if job["processed"] == 1:
-                break
-            # otherwise wait until processed
-            if job["processed"] == 0:
-                time.sleep(poll_interval)
-                continue
-            # if processed==2 (failed), break and return status
-            if job["processed"] == 2:
-                break
-        else:
-            # no job row found — possibly no enqueue (duplicate pending prevented)
-            # fallback: wait for trust_scores updated_at to change / or for trust_scores to appear
-            ts = get_trust_score(conn, user_id)
-            if ts is not None:
-                # if there was no previous score, or updated_at changed, assume updated
-                if before_updated_at is None or ts[2] != before_updated_at:
-                    break
-            time.sleep(poll_interval)
 
+    # perform upsert; the score and audit row are written in the same transaction
+    prev_busy_ms = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+    conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            upsert_user(conn, user_json)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.execute(f"PRAGMA busy_timeout = {prev_busy_ms}")
+
+    job = _find_latest_job(conn, user_id)
     # Final fetches
     final_score_row = get_trust_score(conn, user_id)
-    audits = get_audit_rows(conn, user_id)
+    audits = get_audit_rows(conn, user_id, limit=AUDIT_ROWS_LIMIT)
 
     # Print results (caller can also inspect return value)
     print("== trust_scores ==")
@@ -176,8 +462,7 @@ if __name__ == "__main__":
         "last_active_at": "2025-12-09T14:35:00Z"
     }
 
-    conn = sqlite3.connect(DB_FILE)
-    conn.execute("PRAGMA foreign_keys = ON;")
+    conn = open_conn(DB_FILE)
 
     result = upsert_user_and_wait(conn, sample, timeout=15.0)
     conn.close()
@@ -1,16 +1,33 @@
+import argparse
+import sys
+
 from trust_score import compute_trust_score, parse_iso_datetime
 from datetime import datetime, timezone
 
+def build_parser():
+    p = argparse.ArgumentParser(description="Compute the trust score for a single user.")
+    p.add_argument("--user-id", default="user_cli")
+    p.add_argument("--photos", type=int, default=6, help="number of photos (0–8)")
+    p.add_argument("--bio", action=argparse.BooleanOptionalAction, default=True, help="bio present")
+    p.add_argument("--interests", action=argparse.BooleanOptionalAction, default=True, help="interests present")
+    p.add_argument("--selfie-verified", action=argparse.BooleanOptionalAction, default=True)
+    p.add_argument("--id-verified", action=argparse.BooleanOptionalAction, default=False)
+    p.add_argument("--login-streak-days", type=int, default=7)
+    p.add_argument("--response-rate-pct", type=int, default=80, help="response rate %% (0–100)")
+    p.add_argument("--reports-received", type=int, default=0)
+    p.add_argument("--last-active-at", default=None, help="ISO timestamp (default: now)")
+    return p
+
 def ask_int(label,default=0):
     val = input(f"{label} [{default}]: ").strip()
     if val == "":
         return default
     try:
         return int(val)
-    except:
+    except ValueError:
         print("Invalid Input")
         return default
-    
+
 def ask_bool(label,default=False):
     d = "Y" if default else "N"
     val = input(f"{label} (Y/N) [{d}]: ").strip().lower()
@@ -18,27 +35,53 @@ def ask_bool(label,default=False):
         return default
     return val in ["y","yes"]
 
-def main():
+def ask_args(defaults):
+    """
+    Interactive fallback: prompt for each field, offering the argparse defaults.
+    """
     print("=== Trust Score Input ===")
 
-    user = {}
+    args = argparse.Namespace()
+    args.user_id = input(f"User ID [{defaults.user_id}]: ").strip() or defaults.user_id
+    args.photos = ask_int("Number of photos (0–8)", defaults.photos)
+    args.bio = ask_bool("Bio present", defaults.bio)
+    args.interests = ask_bool("Interests present", defaults.interests)
+    args.selfie_verified = ask_bool("Selfie verified", defaults.selfie_verified)
+    args.id_verified = ask_bool("ID verified", defaults.id_verified)
+    args.login_streak_days = ask_int("Login streak days", defaults.login_streak_days)
+    args.response_rate_pct = ask_int("Response rate % (0–100)", defaults.response_rate_pct)
+    args.reports_received = ask_int("Reports received", defaults.reports_received)
+
+    default_last_active = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    args.last_active_at = input(f"Last active at (ISO) [{default_last_active}]: ").strip() or None
+    return args
+
+def main(argv=None):
+    parser = build_parser()
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv and sys.stdin.isatty():
+        args = ask_args(parser.parse_args([]))
+    else:
+        args = parser.parse_args(argv)
 
-    user["user_id"] = input("User ID [user_cli]: ").strip() or "user_cli"
-    user["photos"] = ask_int("Number of photos (0–8)", 6)
-    user["bio"] = ask_bool("Bio present", True)
-    user["interests"] = ask_bool("Interests present", True)
-    user["selfie_verified"] = ask_bool("Selfie verified", True)
-    user["id_verified"] = ask_bool("ID verified", False)
-    user["login_streak_days"] = ask_int("Login streak days", 7)
-    user["response_rate_pct"] = ask_int("Response rate % (0–100)", 80)
-    user["reports_received"] = ask_int("Reports received", 0)
+    user = {
+        "user_id": args.user_id,
+        "photos": args.photos,
+        "bio": args.bio,
+        "interests": args.interests,
+        "selfie_verified": args.selfie_verified,
+        "id_verified": args.id_verified,
+        "login_streak_days": args.login_streak_days,
+        "response_rate_pct": args.response_rate_pct,
+        "reports_received": args.reports_received,
+    }
 
     default_last_active = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
-    la = input(f"Last active at (ISO) [{default_last_active}]: ").strip() or default_last_active
+    la = args.last_active_at or default_last_active
 
     try:
         parse_iso_datetime(la)
-    except:
+    except ValueError:
         print("Invalid ISO format. Using current time.")
         la = default_last_active
 
@@ -60,4 +103,4 @@ def main():
     print("\nDetails:", result.breakdown)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
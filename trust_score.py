@@ -5,6 +5,7 @@ Single-source trust score calculation engine.
 
 Usage (example):
   python trust_score.py dummy_users.json trust_scores_output.json
+  python trust_score.py dummy_users.json trust_scores_output.json trust_engine.db   # also upsert users into the DB
 
 Functions:
   - compute_profile_score(user)
@@ -13,13 +14,38 @@ Functions:
   - apply_inactivity_decay(score, last_active_iso, reference_dt)
   - assign_badges(result, user, reference_dt)
   - compute_trust_score(user, reference_dt)
+  - compute_trust_scores_vectorized(users, reference_dt)   # final scores only, needs numpy
 """
 
 from __future__ import annotations
 import json
-from dataclasses import dataclass, asdict
-from datetime import datetime, timezone
-from typing import Dict, Any, Optional, List, Tuple
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from itertools import chain, islice
+from typing import Dict, Any, Iterator, Optional, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: only compute_trust_scores_vectorized needs it
+    np = None
+
+try:
+    from numba import njit
+except ImportError:  # optional: JIT-compiles the scalar score kernels when installed
+    njit = None
+
+try:
+    import orjson
+except ImportError:  # optional: faster JSON encoding for compute_batch_from_file
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # optional: compute_batch_from_file falls back to json.load
+    ijson = None
 
 # -------------------------
 # Configuration / constants
@@ -51,6 +77,12 @@ ACTIVITY_REPORTS_CAP = 5
 # decay
 DECAY_PER_WEEK = 5  # -5 per full inactive week
 
+# per-unit scales derived from the splits above (hoisted out of the per-user calculators)
+_PHOTO_SCALE = PHOTOS_MAX_POINTS / PHOTOS_CAP
+_STREAK_SCALE = ACTIVITY_LOGIN_STREAK_MAX / ACTIVITY_STREAK_CAP_DAYS
+_RESP_SCALE = ACTIVITY_RESPONSE_MAX / 100.0
+_REPORT_SCALE = ACTIVITY_REPORTS_PENALTY_MAX / ACTIVITY_REPORTS_CAP
+
 # badge thresholds
 BADGE_THRESHOLDS = {
     "Verified User": {"min_score": 85, "require_id_verification": True},
@@ -58,6 +90,13 @@ BADGE_THRESHOLDS = {
     "Active Dater": {"min_score": 60, "recent_days": 7}
 }
 
+# badge thresholds unpacked once at import (read on every assign_badges call)
+_VU_MIN = BADGE_THRESHOLDS["Verified User"]["min_score"]
+_VU_REQUIRE_ID = BADGE_THRESHOLDS["Verified User"]["require_id_verification"]
+_TM_MIN = BADGE_THRESHOLDS["Trusted Member"]["min_score"]
+_AD_MIN = BADGE_THRESHOLDS["Active Dater"]["min_score"]
+_AD_RECENT_DAYS = BADGE_THRESHOLDS["Active Dater"]["recent_days"]
+
 # -------------------------
 # Data class for result
 # -------------------------
@@ -96,159 +135,411 @@ def parse_iso_datetime(s: Optional[str]) -> Optional[datetime]:
 # -------------------------
 # Component calculators
 # -------------------------
-def compute_profile_score(user: Dict[str, Any]) -> float:
+# The arithmetic lives in scalar-only helpers (plain ints/bools in, floats out) so it can be
+# JIT-compiled by numba when available; the compute_* functions below extract the fields.
+def _profile_points(photos: int, bio: bool, interests: bool) -> float:
     # Photos: linear up to PHOTOS_CAP -> PHOTOS_MAX_POINTS
-    photos = int(user.get("photos", 0) or 0)
-    photos_points = min(photos, PHOTOS_CAP) / PHOTOS_CAP * PHOTOS_MAX_POINTS
-
-    bio_points = BIO_POINTS if bool(user.get("bio")) else 0
-    interests_points = INTERESTS_POINTS if bool(user.get("interests")) else 0
-
-    total = photos_points + bio_points + interests_points
-    # clamp and round
-    return round(max(0.0, min(PROFILE_MAX, total)), 2)
+    photos_points = (PHOTOS_CAP if photos > PHOTOS_CAP else photos) * _PHOTO_SCALE
+    total = photos_points + (BIO_POINTS if bio else 0) + (INTERESTS_POINTS if interests else 0)
+    # PHOTOS_MAX_POINTS + BIO_POINTS + INTERESTS_POINTS == PROFILE_MAX, so only a
+    # (bad, negative) photo count can push the total out of range
+    return round(total if total > 0.0 else 0.0, 2)
 
-def compute_verification_score(user: Dict[str, Any]) -> float:
-    selfie = bool(user.get("selfie_verified"))
-    idv = bool(user.get("id_verified"))
-    total = (SELFIE_POINTS if selfie else 0) + (ID_POINTS if idv else 0)
-    return round(max(0.0, min(VERIFICATION_MAX, total)), 2)
+def _verification_points(selfie: bool, idv: bool) -> float:
+    # SELFIE_POINTS + ID_POINTS == VERIFICATION_MAX, so no clamping is needed
+    return float((SELFIE_POINTS if selfie else 0) + (ID_POINTS if idv else 0))
 
-def compute_activity_score(user: Dict[str, Any]) -> Tuple[float, Dict[str, float]]:
+def _activity_points(streak_days: int, resp: int, reports: int) -> Tuple[float, float, float, float]:
+    """
+    Returns (activity_score, streak_score, response_score, reports_penalty).
+    """
     # login streak mapping 0..ACTIVITY_STREAK_CAP_DAYS -> 0..ACTIVITY_LOGIN_STREAK_MAX
-    streak_days = int(user.get("login_streak_days", 0) or 0)
-    streak_score = min(streak_days, ACTIVITY_STREAK_CAP_DAYS) / ACTIVITY_STREAK_CAP_DAYS * ACTIVITY_LOGIN_STREAK_MAX
+    streak_score = (ACTIVITY_STREAK_CAP_DAYS if streak_days > ACTIVITY_STREAK_CAP_DAYS else streak_days) * _STREAK_SCALE
 
     # response rate 0..100 -> 0..ACTIVITY_RESPONSE_MAX
-    resp = int(user.get("response_rate_pct", 0) or 0)
-    resp_clamped = max(0, min(resp, 100))
-    resp_score = resp_clamped / 100.0 * ACTIVITY_RESPONSE_MAX
+    resp_clamped = 0 if resp < 0 else (100 if resp > 100 else resp)
+    resp_score = resp_clamped * _RESP_SCALE
 
     # reports: 0..ACTIVITY_REPORTS_CAP -> 0..-ACTIVITY_REPORTS_PENALTY_MAX
-    reports = int(user.get("reports_received", 0) or 0)
-    reports_clamped = min(reports, ACTIVITY_REPORTS_CAP)
-    reports_penalty = - (reports_clamped / ACTIVITY_REPORTS_CAP) * ACTIVITY_REPORTS_PENALTY_MAX
+    reports_clamped = ACTIVITY_REPORTS_CAP if reports > ACTIVITY_REPORTS_CAP else reports
+    reports_penalty = - reports_clamped * _REPORT_SCALE
 
     total = streak_score + resp_score + reports_penalty
-    total = max(-ACTIVITY_REPORTS_PENALTY_MAX, total)  # lower bound (avoid extreme negatives)
-    total = min(ACTIVITY_MAX, total)
-    return round(total, 2), {
-        "streak_score": round(streak_score,2),
-        "response_score": round(resp_score,2),
-        "reports_penalty": round(reports_penalty,2)
+    if total < -ACTIVITY_REPORTS_PENALTY_MAX:  # lower bound (avoid extreme negatives)
+        total = -ACTIVITY_REPORTS_PENALTY_MAX
+    elif total > ACTIVITY_MAX:
+        total = ACTIVITY_MAX
+    return round(total, 2), round(streak_score, 2), round(resp_score, 2), round(reports_penalty, 2)
+
+def _trust_kernel(photos: int, bio: bool, interests: bool, selfie: bool, idv: bool,
+                  streak_days: int, resp: int, reports: int) -> Tuple[float, float, float, float, float, float]:
+    """
+    All three components in one call:
+    (profile, verification, activity, streak_score, response_score, reports_penalty).
+    """
+    activity, streak_score, resp_score, reports_penalty = _activity_points(streak_days, resp, reports)
+    return (_profile_points(photos, bio, interests), _verification_points(selfie, idv),
+            activity, streak_score, resp_score, reports_penalty)
+
+if njit is not None:
+    # compiled lazily on first call; cache=True keeps the machine code in __pycache__
+    _profile_points = njit(cache=True)(_profile_points)
+    _verification_points = njit(cache=True)(_verification_points)
+    _activity_points = njit(cache=True)(_activity_points)
+    _trust_kernel = njit(cache=True)(_trust_kernel)
+
+def _user_scalars(user: Dict[str, Any]) -> Tuple[int, bool, bool, bool, bool, int, int, int]:
+    # the _trust_kernel arguments, coerced to the types the kernels are compiled for
+    return (
+        int(user.get("photos", 0) or 0),
+        bool(user.get("bio")),
+        bool(user.get("interests")),
+        bool(user.get("selfie_verified")),
+        bool(user.get("id_verified")),
+        int(user.get("login_streak_days", 0) or 0),
+        int(user.get("response_rate_pct", 0) or 0),
+        int(user.get("reports_received", 0) or 0),
+    )
+
+def compute_profile_score(user: Dict[str, Any]) -> float:
+    return _profile_points(int(user.get("photos", 0) or 0), bool(user.get("bio")), bool(user.get("interests")))
+
+def compute_verification_score(user: Dict[str, Any]) -> float:
+    return _verification_points(bool(user.get("selfie_verified")), bool(user.get("id_verified")))
+
+def compute_activity_score(user: Dict[str, Any]) -> Tuple[float, Dict[str, float]]:
+    total, streak_score, resp_score, reports_penalty = _activity_points(
+        int(user.get("login_streak_days", 0) or 0),
+        int(user.get("response_rate_pct", 0) or 0),
+        int(user.get("reports_received", 0) or 0),
+    )
+    return total, {
+        "streak_score": streak_score,
+        "response_score": resp_score,
+        "reports_penalty": reports_penalty
     }
 
 # -------------------------
 # Decay and badges
 # -------------------------
-def apply_inactivity_decay(base_score: float, last_active_iso: Optional[str], reference_dt: Optional[datetime]=None) -> Tuple[float, float]:
+def _clamp_score(score: float) -> float:
+    # 0..MAX_SCORE with plain comparisons (cheaper than max(0.0, min(MAX_SCORE, score)))
+    return MAX_SCORE if score > MAX_SCORE else (0.0 if score < 0.0 else score)
+
+def apply_inactivity_decay(base_score: float, last_active_iso: Optional[str], reference_dt: Optional[datetime]=None,
+                           last_active_dt: Optional[datetime]=None) -> Tuple[float, float]:
     """
     Returns (new_score, decay_applied)
     - last_active_iso: ISO date string (YYYY-MM-DD or full)
+    - last_active_dt: last_active_iso already parsed (skips the parse when given)
     - decay per full week of inactivity: DECAY_PER_WEEK
     """
     if reference_dt is None:
         reference_dt = datetime.now(timezone.utc)
 
-    if not last_active_iso:
-        # If no last_active value, do not apply decay automatically (policy choice).
-        return round(max(0.0, min(MAX_SCORE, base_score)), 2), 0.0
+    if last_active_dt is None:
+        if not last_active_iso:
+            # If no last_active value, do not apply decay automatically (policy choice).
+            return round(_clamp_score(base_score), 2), 0.0
+        last_active_dt = parse_iso_datetime(last_active_iso)
 
-    last_active_dt = parse_iso_datetime(last_active_iso)
     days_inactive = (reference_dt - last_active_dt).days
     full_weeks = days_inactive // 7
     decay = full_weeks * DECAY_PER_WEEK
-    new_score = max(0.0, base_score - decay)
-    new_score = min(MAX_SCORE, new_score)
+    new_score = _clamp_score(base_score - decay)
     return round(new_score,2), float(decay)
 
-def assign_badges(result: TrustScoreResult, user: Dict[str, Any], reference_dt: Optional[datetime]=None) -> List[str]:
+def assign_badges(result: TrustScoreResult, user: Dict[str, Any], reference_dt: Optional[datetime]=None,
+                  last_active_dt: Optional[datetime]=None) -> List[str]:
     if reference_dt is None:
         reference_dt = datetime.now(timezone.utc)
+    return _badges_for_score(result.final_score, user, reference_dt, last_active_dt)
 
+def _badges_for_score(score: float, user: Dict[str, Any], reference_dt: datetime,
+                      last_active_dt: Optional[datetime]=None) -> List[str]:
     badges: List[str] = []
-    score = result.final_score
-    id_verified = bool(user.get("id_verified"))
-    selfie = bool(user.get("selfie_verified"))
 
     # Verified User: require id_verified True and score >= threshold
-    vcfg = BADGE_THRESHOLDS["Verified User"]
-    if id_verified and score >= vcfg["min_score"]:
+    if score >= _VU_MIN and (user.get("id_verified") or not _VU_REQUIRE_ID):
         badges.append("Verified User")
 
     # Trusted Member
-    if score >= BADGE_THRESHOLDS["Trusted Member"]["min_score"]:
+    if score >= _TM_MIN:
         badges.append("Trusted Member")
 
-    # Active Dater: require recent activity
-    adcfg = BADGE_THRESHOLDS["Active Dater"]
-    last_active_iso = user.get("last_active_at")
-    recent = False
-    if last_active_iso:
-        last_active_dt = parse_iso_datetime(last_active_iso)
-        days_ago = (reference_dt - last_active_dt).days
-        recent = days_ago <= adcfg["recent_days"]
-    if score >= adcfg["min_score"] and recent:
-        badges.append("Active Dater")
+    # Active Dater: require recent activity (only looked at once the score qualifies)
+    if score >= _AD_MIN:
+        if last_active_dt is None and user.get("last_active_at"):
+            last_active_dt = parse_iso_datetime(user["last_active_at"])
+        if last_active_dt is not None and (reference_dt - last_active_dt).days <= _AD_RECENT_DAYS:
+            badges.append("Active Dater")
 
     return badges
 
 # -------------------------
 # Orchestrator
 # -------------------------
+def _score_parts(kernel_out: Tuple[float, float, float, float, float, float], last_active_iso: Optional[str],
+                 last_active_dt: Optional[datetime], reference_dt: datetime) -> Tuple[float, Tuple[float, ...]]:
+    # _trust_kernel output -> (final_score, parts); see compute_trust_score_arr for `parts`
+    profile_score, verification_score, activity_score, streak_score, resp_score, reports_penalty = kernel_out
+
+    raw_total = profile_score + verification_score + activity_score
+    # cap raw_total before decay
+    raw_total = _clamp_score(raw_total)
+    raw_total = round(raw_total, 2)
+
+    final_score, decay_applied = apply_inactivity_decay(raw_total, last_active_iso, reference_dt, last_active_dt)
+    return final_score, (profile_score, verification_score, activity_score, raw_total, decay_applied,
+                         streak_score, resp_score, reports_penalty)
+
+def _build_result_dict(user: Dict[str, Any], reference_dt: datetime) -> Dict[str, Any]:
+    """
+    Score one user into a plain dict with the TrustScoreResult fields.
+    The batch path serializes this directly instead of going through dataclasses.asdict.
+    """
+    uid = user.get("user_id", "unknown")
+
+    # parse last_active_at once; decay and badges both need it
+    last_active_iso = user.get("last_active_at")
+    last_active_dt = parse_iso_datetime(last_active_iso) if last_active_iso else None
+
+    final_score, (profile_score, verification_score, activity_score, raw_total, decay_applied,
+                  streak_score, resp_score, reports_penalty) = _score_parts(
+        _trust_kernel(*_user_scalars(user)), last_active_iso, last_active_dt, reference_dt)
+
+    return {
+        "user_id": uid,
+        "profile_score": profile_score,
+        "verification_score": verification_score,
+        "activity_score": activity_score,
+        "raw_total": raw_total,
+        "decay_applied": decay_applied,
+        "final_score": final_score,
+        # badges are based on final_score and attributes
+        "badges": _badges_for_score(final_score, user, reference_dt, last_active_dt),
+        "breakdown": {
+            "activity_breakdown": {
+                "streak_score": streak_score,
+                "response_score": resp_score,
+                "reports_penalty": reports_penalty
+            },
+            "last_active_at": last_active_iso
+        }
+    }
+
 def compute_trust_score(user: Dict[str, Any], reference_dt: Optional[datetime]=None) -> TrustScoreResult:
     """
     Compute detailed trust score for a single user dict.
     """
     if reference_dt is None:
         reference_dt = datetime.now(timezone.utc)
+    return TrustScoreResult(**_build_result_dict(user, reference_dt))
 
-    uid = user.get("user_id", "unknown")
+def compute_trust_score_arr(photos: int, bio: bool, interests: bool, selfie_verified: bool, id_verified: bool,
+                            login_streak_days: int, response_rate_pct: int, reports_received: int,
+                            last_active_at: Optional[str] = None,
+                            reference_dt: Optional[datetime] = None) -> Tuple[float, Tuple[float, ...]]:
+    """
+    compute_trust_score for already-unpacked fields (e.g. a users row), without building
+    the input dict or the result object. Returns (final_score, parts) where parts is
+    (profile_score, verification_score, activity_score, raw_total, decay_applied,
+     streak_score, response_score, reports_penalty).
+    Badges are not computed; trust_breakdown(parts, last_active_at) gives the breakdown dict.
+    """
+    if reference_dt is None:
+        reference_dt = datetime.now(timezone.utc)
+    last_active_dt = parse_iso_datetime(last_active_at) if last_active_at else None
+    kernel_out = _trust_kernel(int(photos or 0), bool(bio), bool(interests), bool(selfie_verified), bool(id_verified),
+                               int(login_streak_days or 0), int(response_rate_pct or 0), int(reports_received or 0))
+    return _score_parts(kernel_out, last_active_at, last_active_dt, reference_dt)
 
-    profile_score = compute_profile_score(user)
-    verification_score = compute_verification_score(user)
-    activity_score, activity_breakdown = compute_activity_score(user)
+def trust_breakdown(parts: Tuple[float, ...], last_active_at: Optional[str]) -> Dict[str, Any]:
+    """
+    The TrustScoreResult.breakdown dict for compute_trust_score_arr's `parts`.
+    """
+    return {
+        "activity_breakdown": {
+            "streak_score": parts[5],
+            "response_score": parts[6],
+            "reports_penalty": parts[7]
+        },
+        "last_active_at": last_active_at
+    }
 
-    raw_total = profile_score + verification_score + activity_score
-    # cap raw_total before decay
-    raw_total = max(0.0, min(MAX_SCORE, raw_total))
-    raw_total = round(raw_total, 2)
+# -------------------------
+# Vectorized batch scoring
+# -------------------------
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_US_PER_DAY = 86400 * 10**6
 
-    final_score, decay_applied = apply_inactivity_decay(raw_total, user.get("last_active_at"), reference_dt)
-
-    # build result
-    result = TrustScoreResult(
-        user_id=uid,
-        profile_score=profile_score,
-        verification_score=verification_score,
-        activity_score=activity_score,
-        raw_total=raw_total,
-        decay_applied=decay_applied,
-        final_score=final_score,
-        badges=[],
-        breakdown={
-            "activity_breakdown": activity_breakdown,
-            "last_active_at": user.get("last_active_at")
-        }
-    )
-    # assign badges (based on final_score and attributes)
-    result.badges = assign_badges(result, user, reference_dt)
-    return result
+def _epoch_us(dt: datetime) -> int:
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+def _parse_iso_column(values: List[Optional[str]]) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Parse a column of last_active_at strings into (present mask, UTC epoch microseconds).
+    UTC "...Z" timestamps (the common case) are converted by a single numpy parse of the
+    whole column; anything else (offsets, naive local times, date-only) goes through
+    parse_iso_datetime so results match the scalar path.
+    """
+    n = len(values)
+    present = np.zeros(n, dtype=bool)
+    epoch_us = np.zeros(n, dtype=np.int64)
+    utc_idx: List[int] = []
+    utc_vals: List[str] = []
+    for i, s in enumerate(values):
+        if not s:
+            continue
+        present[i] = True
+        if s.endswith("Z"):
+            utc_idx.append(i)
+            utc_vals.append(s[:-1])
+        else:
+            epoch_us[i] = _epoch_us(parse_iso_datetime(s))
+    if utc_idx:
+        try:
+            epoch_us[utc_idx] = np.array(utc_vals, dtype="datetime64[us]").astype(np.int64)
+        except ValueError:
+            # something numpy can't read but fromisoformat might; parse those rows one by one
+            for i in utc_idx:
+                epoch_us[i] = _epoch_us(parse_iso_datetime(values[i]))
+    return present, epoch_us
+
+def _int_column(users: List[Dict[str, Any]], key: str) -> "np.ndarray":
+    return np.fromiter((int(u.get(key, 0) or 0) for u in users), dtype=np.float64, count=len(users))
+
+def _flag_column(users: List[Dict[str, Any]], key: str) -> "np.ndarray":
+    return np.fromiter((1.0 if u.get(key) else 0.0 for u in users), dtype=np.float64, count=len(users))
+
+def compute_trust_scores_vectorized(users: List[Dict[str, Any]], reference_dt: Optional[datetime]=None) -> "np.ndarray":
+    """
+    Final scores for many users at once, as a float64 array aligned with `users`.
+    Applies the same rules as compute_trust_score (including decay) as whole-column
+    numpy arithmetic, but builds no breakdown or badges — use compute_trust_score
+    for those. Requires numpy.
+    """
+    if np is None:
+        raise RuntimeError("compute_trust_scores_vectorized requires numpy")
+    if reference_dt is None:
+        reference_dt = datetime.now(timezone.utc)
+
+    # profile
+    photos = _int_column(users, "photos")
+    profile = np.minimum(photos, PHOTOS_CAP) * _PHOTO_SCALE
+    profile += _flag_column(users, "bio") * BIO_POINTS
+    profile += _flag_column(users, "interests") * INTERESTS_POINTS
+    np.maximum(profile, 0.0, out=profile)
+    np.round(profile, 2, out=profile)
+
+    # verification
+    verification = _flag_column(users, "selfie_verified") * SELFIE_POINTS + _flag_column(users, "id_verified") * ID_POINTS
+
+    # activity
+    streak = np.minimum(_int_column(users, "login_streak_days"), ACTIVITY_STREAK_CAP_DAYS) * _STREAK_SCALE
+    resp = np.clip(_int_column(users, "response_rate_pct"), 0, 100) * _RESP_SCALE
+    reports = -np.minimum(_int_column(users, "reports_received"), ACTIVITY_REPORTS_CAP) * _REPORT_SCALE
+    activity = streak + resp + reports
+    np.clip(activity, -ACTIVITY_REPORTS_PENALTY_MAX, ACTIVITY_MAX, out=activity)
+    np.round(activity, 2, out=activity)
+
+    raw_total = profile + verification + activity
+    np.clip(raw_total, 0.0, MAX_SCORE, out=raw_total)
+    np.round(raw_total, 2, out=raw_total)
+
+    # decay: full inactive weeks, from microsecond offsets so day boundaries match timedelta.days
+    has_last_active, last_active_us = _parse_iso_column([u.get("last_active_at") for u in users])
+    reference_us = _epoch_us(reference_dt)
+    full_weeks = ((reference_us - last_active_us) // _US_PER_DAY) // 7
+    decay = np.where(has_last_active, full_weeks * DECAY_PER_WEEK, 0).astype(np.float64)
+
+    final = raw_total - decay
+    np.clip(final, 0.0, MAX_SCORE, out=final)
+    return np.round(final, 2, out=final)
 
 # -------------------------
 # CLI / file helpers
 # -------------------------
-def compute_batch_from_file(input_json_path: str, output_json_path: str, reference_dt: Optional[datetime]=None) -> None:
-    with open(input_json_path, "r", encoding="utf-8") as f:
-        users = json.load(f)
+def _json_bytes(obj: Any) -> bytes:
+    # compact UTF-8 JSON; orjson when installed, else the stdlib encoder with the same output
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _iter_users(input_json_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the user dicts from a JSON array file, streaming with ijson when it's installed.
+    """
+    if ijson is not None:
+        with open(input_json_path, "rb") as f:
+            yield from ijson.items(f, "item")
+    else:
+        with open(input_json_path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+
+# batches with more users than this are scored on a process pool
+PARALLEL_MIN_USERS = 5000
+_PARALLEL_CHUNKSIZE = 512
+_PARALLEL_WINDOW = 64 * _PARALLEL_CHUNKSIZE  # users handed to the pool at a time (bounds memory)
+
+def _score_one(user: Dict[str, Any], reference_dt: datetime) -> bytes:
+    # module-level (picklable) per-user task for the process pool; returns the encoded result
+    return _json_bytes(_build_result_dict(user, reference_dt))
+
+def _score_stream(users: Iterator[Dict[str, Any]], reference_dt: datetime, workers: Optional[int]) -> Iterator[bytes]:
+    """
+    Yield encoded results in input order. Small inputs (or single-CPU hosts) are scored in this
+    process; once more than PARALLEL_MIN_USERS users are seen, scoring moves to a ProcessPoolExecutor, fed one window
+    at a time so a streamed input never has to be held in memory whole.
+    """
+    score = partial(_score_one, reference_dt=reference_dt)
+    head = list(islice(users, PARALLEL_MIN_USERS + 1))
+    if len(head) <= PARALLEL_MIN_USERS or (workers or os.cpu_count() or 1) < 2:
+        yield from map(score, chain(head, users))
+        return
+    remaining = chain(head, users)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        while True:
+            window = list(islice(remaining, _PARALLEL_WINDOW))
+            if not window:
+                break
+            yield from ex.map(score, window, chunksize=_PARALLEL_CHUNKSIZE)
+
+def compute_batch_from_file(input_json_path: str, output_json_path: str, reference_dt: Optional[datetime]=None,
+                            db_path: Optional[str]=None, db_chunk: int=1000, workers: Optional[int]=None) -> None:
+    """
+    Score every user in `input_json_path` and write the results to `output_json_path`
+    as a compact JSON array, one result per line, streamed as each user is scored.
+    Inputs larger than PARALLEL_MIN_USERS are scored on `workers` processes (default: CPU count).
+    If `db_path` is given (DB mode), the users are also upserted into that database in
+    batches of `db_chunk` rows per transaction.
+    """
     if reference_dt is None:
         reference_dt = datetime.now(timezone.utc)
 
-    results = []
-    for u in users:
-        res = compute_trust_score(u, reference_dt)
-        results.append(asdict(res))
-    # write to output
-    with open(output_json_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
-    print(f"Wrote {len(results)} trust score results to {output_json_path}")
+    if db_path is not None:
+        # imported lazily: the scoring engine itself has no DB dependency
+        from db_upsert import open_conn, upsert_users_bulk
+        conn = open_conn(db_path)
+        try:
+            n = upsert_users_bulk(conn, _iter_users(input_json_path), chunk=db_chunk)
+        finally:
+            conn.close()
+        print(f"Upserted {n} users into {db_path}")
+
+    count = 0
+    with open(output_json_path, "wb") as f:
+        f.write(b"[")
+        for encoded in _score_stream(_iter_users(input_json_path), reference_dt, workers):
+            f.write(b",\n" if count else b"\n")
+            f.write(encoded)
+            count += 1
+        f.write(b"\n]\n")
+    print(f"Wrote {count} trust score results to {output_json_path}")
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) not in (3, 4):
+        print("usage: python trust_score.py <input.json> <output.json> [db_file]")
+        sys.exit(2)
+    compute_batch_from_file(sys.argv[1], sys.argv[2], db_path=sys.argv[3] if len(sys.argv) == 4 else None)
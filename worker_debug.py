@@ -1,197 +1,551 @@
 # worker_debug.py — verbose debug worker (drop-in)
 import sqlite3
 import time
-import traceback
 import socket
+import sys
 import os
 import json
-from typing import Optional, Dict, Any
+import logging
+import select
+import stat
+import queue
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Sequence, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional: faster audit details serialization
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # optional: audit details are stored as plain JSON text without it
+    zstandard = None
 
 DB_FILE = "trust_engine.db"
 POLL_INTERVAL = 1.0
-CLAIM_TIMEOUT = 30.0
+# jobs claimed (and persisted) per transaction
+CLAIM_BATCH = 32
+# seconds between WAL checkpoints the worker runs itself while idle
+CHECKPOINT_INTERVAL = 300.0
+# seconds between PRAGMA optimize runs (planner statistics refresh) while idle
+OPTIMIZE_INTERVAL = 3600.0
+# audit rows are written off the batch path by AuditWriter: queue bound, and rows /
+# seconds per flush
+AUDIT_QUEUE_SIZE = 1024
+AUDIT_FLUSH_ROWS = 256
+AUDIT_FLUSH_INTERVAL = 0.05
+# how long close() waits for queue space for its stop sentinel
+AUDIT_CLOSE_TIMEOUT = 5.0
+# zstd level for compressed audit details (used only when zstandard is installed)
+AUDIT_ZSTD_LEVEL = 3
+
+# claim_jobs uses UPDATE ... RETURNING, which needs SQLite 3.35+.
 
-# Import compute_trust_score from your engine.
+# Applied once per worker connection. WAL lets the worker commit alongside the API
+# writer and readers, synchronous=NORMAL turns each commit into a WAL append instead
+# of an fsync, and busy_timeout makes SQLite itself retry a locked BEGIN IMMEDIATE
+# (for up to 5s) rather than failing the claim straight away. busy_timeout comes first:
+# the connection is opened with timeout=0, so the WAL switch itself needs it to wait
+# out a lock held by another connection. wal_autocheckpoint and journal_size_limit
+# keep the -wal file from growing without bound between checkpoints.
+PRAGMAS = """
+PRAGMA busy_timeout = 5000;
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -20000;
+PRAGMA mmap_size = 268435456;
+PRAGMA foreign_keys = ON;
+PRAGMA wal_autocheckpoint = 1000;
+PRAGMA journal_size_limit = 67108864;
+"""
+
+# The second, read-only connection used for user fetches (see open_reader). Under WAL
+# its reads run against the last committed snapshot and never wait on a writer.
+READER_PRAGMAS = """
+PRAGMA busy_timeout = 5000;
+PRAGMA query_only = 1;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -20000;
+PRAGMA mmap_size = 268435456;
+"""
+
+# Import the scoring entry points from your engine. The worker scores users rows
+# straight from their columns (compute_trust_score_arr) and only builds the
+# breakdown dict (trust_breakdown) for rows that get an audit entry.
 try:
-    from trust_score import compute_trust_score
+    from trust_score import compute_trust_score_arr, trust_breakdown
 except Exception as e:
-    raise RuntimeError("IMPORT ERROR: failed to import compute_trust_score from trust_score.py: " + repr(e))
+    raise RuntimeError("IMPORT ERROR: failed to import compute_trust_score_arr from trust_score.py: " + repr(e))
+
+# The worker relies on compute_trust_score_arr returning (float final_score, parts)
+# with trust_breakdown(parts, ...) a dict; check that once here with a dummy user
+# instead of probing every result.
+_probe = compute_trust_score_arr(0, False, False, False, False, 0, 0, 0)
+if not (isinstance(_probe[0], float) and isinstance(trust_breakdown(_probe[1], None), dict)):
+    raise RuntimeError(f"compute_trust_score_arr must return (float, parts) usable by trust_breakdown, got {_probe!r}")
+del _probe
+
+from db_upsert import notify_path
 
-def log(*args, **kwargs):
-    print(*args, **kwargs, flush=True)
+# Level from $WORKER_LOG (default INFO); per-step detail is logged at DEBUG.
+logger = logging.getLogger("worker")
 
-def claim_job(conn: sqlite3.Connection, worker_name: str) -> Optional[Dict[str, Any]]:
-    cur = conn.cursor()
+def open_notify_fifo(path: str) -> Optional[tuple]:
+    """
+    Create (if needed) and open the notify FIFO producers write to after enqueuing
+    (db_upsert.notify_workers). Returns (read_fd, write_fd), or None when FIFOs are
+    unavailable, in which case the worker falls back to plain timed polling.
+    """
+    if not hasattr(os, "mkfifo"):
+        return None
+    try:
+        os.mkfifo(path, 0o660)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        logger.warning("[open_notify_fifo] cannot create %s - %s", path, e)
+        return None
+    if not stat.S_ISFIFO(os.stat(path).st_mode):
+        logger.warning("[open_notify_fifo] %s exists and is not a FIFO — polling instead", path)
+        return None
+    rfd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    # Hold a write end ourselves so the read end never sees EOF (which would make
+    # select() return immediately) while no producer has the FIFO open.
+    wfd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+    return rfd, wfd
+
+def wait_for_jobs(fifo: Optional[tuple], timeout: float):
+    """
+    Block until a producer signals new jobs or `timeout` seconds pass.
+    """
+    if fifo is None:
+        time.sleep(timeout)
+        return
+    rfd = fifo[0]
+    ready, _, _ = select.select([rfd], [], [], timeout)
+    if ready:
+        # drain all pending wakeups; one claim pass picks up every committed job
+        try:
+            while os.read(rfd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+# Statement text is constant (timestamps are bound, not datetime('now')), so each one is
+# parsed once and then served from the connection's statement cache.
+CACHED_STATEMENTS = 256
+
+# enqueued_at as an integer even if a producer wrote text/real into it (create_schema's
+# trigger normally rewrites those); unparseable text reads as 0
+_ENQUEUED_AT_INT = """CASE WHEN typeof(enqueued_at) IN ('integer', 'real') THEN CAST(enqueued_at AS INTEGER)
+    ELSE coalesce(CAST(strftime('%s', enqueued_at) AS INTEGER), 0) END"""
+
+_SQL_CLAIM = """
+UPDATE recompute_jobs
+SET processing = 1, processor = ?, attempts = attempts + 1
+WHERE id IN (
+    SELECT id FROM recompute_jobs
+    WHERE processed = 0 AND processing = 0
+    ORDER BY enqueued_at ASC, id ASC
+    LIMIT ?
+)
+RETURNING id, user_id, {}, attempts;
+""".format(_ENQUEUED_AT_INT)
+
+# formatted with one "?" per user id; at most CLAIM_BATCH distinct texts, all cached.
+# Columns after user_id are compute_trust_score_arr's arguments, in order.
+_SQL_FETCH_USERS = """
+SELECT user_id, photos, bio_filled, interests_count,
+       selfie_verified, id_verified, login_streak,
+       response_rate_pct, reports_count, last_active_at
+FROM users WHERE user_id IN ({});
+"""
+
+# Leaves an unchanged score (and its updated_at) alone; RETURNING yields a row only
+# when the score was inserted or actually changed, which is when an audit row is due.
+_SQL_UPSERT_SCORE = """
+INSERT INTO trust_scores(user_id, score, updated_at)
+VALUES (?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+   score = excluded.score,
+   updated_at = excluded.updated_at
+WHERE trust_scores.score IS NOT excluded.score
+RETURNING user_id;
+"""
+
+_SQL_AUDIT = """
+INSERT INTO trust_score_audit(user_id, new_score, details, details_codec, computed_at)
+VALUES (?, ?, ?, ?, ?);
+"""
+
+# recompute_jobs timestamps are unix seconds (schema v4), so the job's enqueue-to-done
+# latency comes back from the same statement as a plain integer
+_SQL_MARK_DONE = """
+UPDATE recompute_jobs
+SET processed = 1, processed_at = ?, processing = 0
+WHERE id = ?
+RETURNING processed_at - {};
+""".format(_ENQUEUED_AT_INT)
+
+_SQL_MARK_FAIL = """
+UPDATE recompute_jobs
+SET processed = 2, last_error = ?, processed_at = ?, processing = 0
+WHERE id = ?;
+"""
+
+def _now(t: Optional[float] = None) -> str:
+    # same text format as SQLite's datetime('now') (UTC)
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t))
+
+def claim_jobs(conn: sqlite3.Connection, worker_name: str, limit: int = CLAIM_BATCH) -> List[Dict[str, Any]]:
+    """
+    Mark up to `limit` of the oldest pending jobs as processing by `worker_name` and
+    return them, oldest first. Returns [] when the queue is empty or the DB stays busy.
+    """
     try:
         conn.execute("BEGIN IMMEDIATE;")
-        cur.execute("""
-            SELECT id, user_id FROM recompute_jobs
-            WHERE processed = 0 AND processing = 0
-            ORDER BY enqueued_at ASC
-            LIMIT 1;
-        """)
-        row = cur.fetchone()
-        if row is None:
-            conn.commit()
-            return None
-        job_id, user_id = row[0], row[1]
-        cur.execute("""
-            UPDATE recompute_jobs
-            SET processing = 1, processor = ?, attempts = attempts + 1
-            WHERE id = ?;
-        """, (worker_name, job_id))
+        # pick + mark in one statement; served by the partial index idx_rj_pending
+        rows = conn.execute(_SQL_CLAIM, (worker_name, limit)).fetchall()
+        # RETURNING order is unspecified; sorted before the commit so nothing after it can
+        # fail and strand the claimed jobs as processing
+        rows.sort(key=lambda r: (r[2], r[0]))
         conn.commit()
-        cur.execute("SELECT id, user_id, enqueued_at, attempts FROM recompute_jobs WHERE id = ? LIMIT 1;", (job_id,))
-        r = cur.fetchone()
-        return {"id": r[0], "user_id": r[1], "enqueued_at": r[2], "attempts": r[3]}
     except sqlite3.OperationalError as oe:
         try:
             conn.rollback()
         except Exception:
             pass
-        log("[claim_job] OperationalError (probably DB busy):", oe)
-        return None
+        logger.warning("[claim_jobs] OperationalError (probably DB busy): %s", oe)
+        return []
     except Exception as ee:
         try:
             conn.rollback()
         except Exception:
             pass
         raise
+    return [{"id": r[0], "user_id": r[1], "enqueued_at": r[2], "attempts": r[3]} for r in rows]
 
-def fetch_user_as_dict(conn: sqlite3.Connection, user_id: str) -> Optional[Dict[str, Any]]:
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT user_id, photos, bio_filled, interests_count,
-               selfie_verified, id_verified, login_streak,
-               response_rate_pct, reports_count, last_active_at
-        FROM users WHERE user_id = ? LIMIT 1;
-    """, (user_id,))
-    r = cur.fetchone()
-    if r is None:
-        return None
-    return {
-        "user_id": r[0],
-        "photos": int(r[1]) if r[1] is not None else 0,
-        "bio": bool(r[2]),
-        "interests": int(r[3]) if r[3] is not None else 0,
-        "selfie_verified": bool(r[4]),
-        "id_verified": bool(r[5]),
-        "login_streak_days": int(r[6]) if r[6] is not None else 0,
-        "response_rate_pct": int(r[7]) if r[7] is not None else 0,
-        "reports_received": int(r[8]) if r[8] is not None else 0,
-        "last_active_at": r[9],
-    }
-
-def upsert_trust_score_and_audit(conn: sqlite3.Connection, user_id: str, final_score: float, details_obj: Any):
-    cur = conn.cursor()
-    # Upsert trust_scores
-    cur.execute(
-        """
-        INSERT INTO trust_scores(user_id, score, updated_at)
-        VALUES (?, ?, datetime('now'))
-        ON CONFLICT(user_id) DO UPDATE SET
-           score = excluded.score,
-           updated_at = datetime('now');
-        """,
-        (user_id, final_score),
-    )
-    # Serialize details
+def fetch_user_rows(conn: sqlite3.Connection, user_ids: Sequence[str]) -> Dict[str, tuple]:
+    """
+    users rows (_SQL_FETCH_USERS columns) for `user_ids` with one SELECT, keyed by user_id.
+    Ids with no users row are simply absent.
+    """
+    ids = list(dict.fromkeys(user_ids))
+    if not ids:
+        return {}
+    sql = _SQL_FETCH_USERS.format(",".join("?" * len(ids)))
+    # users counters/flags are NOT NULL DEFAULT 0 (schema v5), so row values go to
+    # compute_trust_score_arr as-is
+    return {r[0]: r for r in conn.execute(sql, ids)}
+
+def _details_json(details_obj: Any) -> str:
+    # decoded to str so the TEXT details column keeps holding text, not BLOBs
+    if orjson is not None:
+        try:
+            return orjson.dumps(details_obj, default=str).decode()
+        except TypeError:
+            pass  # e.g. non-str dict keys; the stdlib encoder below accepts them
     try:
-        details_json = json.dumps(details_obj, default=str)
+        return json.dumps(details_obj, default=str)
     except Exception as e:
-        details_json = str(details_obj)
-        log("[upsert_trust_score_and_audit] details JSON serialization failed:", e)
-    cur.execute(
+        logger.warning("[_details_json] details JSON serialization failed: %s", e)
+        return str(details_obj)
+
+# ZstdCompressor objects must not be shared between threads (the AuditWriter thread and
+# the inline overflow path both encode), so each thread gets its own
+_zstd_local = threading.local()
+
+def _audit_details(details_obj: Any) -> Tuple[Any, str]:
+    """
+    (details value, details_codec) for an audit row: zstd-compressed JSON as a BLOB when
+    zstandard is installed and compression actually shrinks it, else the JSON text.
+    Readers decode with db_upsert.decode_details.
+    """
+    text = _details_json(details_obj)
+    if zstandard is None:
+        return text, "json"
+    cctx = getattr(_zstd_local, "cctx", None)
+    if cctx is None:
+        cctx = _zstd_local.cctx = zstandard.ZstdCompressor(level=AUDIT_ZSTD_LEVEL)
+    raw = text.encode("utf-8")
+    blob = cctx.compress(raw)
+    if len(blob) >= len(raw):
+        return text, "json"
+    return blob, "zstd"
+
+def upsert_trust_scores(conn: sqlite3.Connection, scored: Sequence[Tuple[str, float, Any]], now: str) -> List[Tuple[str, float, Any]]:
+    """
+    `scored` is (user_id, final_score, (parts, last_active_at)) per computed job, the last
+    item being what trust_breakdown() turns into the audit details. Returns the entries
+    whose score was inserted or changed — the ones that need an audit row.
+    """
+    # one execute per row (executemany discards RETURNING rows)
+    changed = [
+        (uid, score, details) for uid, score, details in scored
+        if conn.execute(_SQL_UPSERT_SCORE, (uid, score, now)).fetchone() is not None
+    ]
+    if len(changed) < len(scored):
+        logger.debug("[worker_debug] %d unchanged score(s), audit skipped", len(scored) - len(changed))
+    return changed
+
+def insert_audits(conn: sqlite3.Connection, changed: Sequence[Tuple[str, float, Any]], now: str):
+    conn.executemany(_SQL_AUDIT, [(uid, score, *_audit_details(trust_breakdown(*details)), now)
+                                  for uid, score, details in changed])
+
+class AuditWriter:
+    """
+    Background thread that serializes and inserts audit rows on its own connection, so
+    the worker's batch transaction only carries the trust_scores and job updates.
+    Rows are written with one executemany per AUDIT_FLUSH_ROWS rows or
+    AUDIT_FLUSH_INTERVAL seconds, whichever comes first. Audits are not atomic with
+    their score: rows still queued when the process is killed are lost (close() flushes).
+    """
+
+    def __init__(self, db_path: str = DB_FILE):
+        self._q: "queue.Queue" = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, args=(db_path,), name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, changed: Sequence[Tuple[str, float, Any]], now: str) -> List[Tuple[str, float, Any]]:
         """
-        INSERT INTO trust_score_audit(user_id, new_score, details, computed_at)
-        VALUES (?, ?, ?, datetime('now'));
-        """,
-        (user_id, final_score, details_json),
-    )
-    conn.commit()
-
-def mark_job_done(conn: sqlite3.Connection, job_id: int):
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE recompute_jobs
-        SET processed = 1, processed_at = datetime('now'), processing = 0
-        WHERE id = ?;
-    """, (job_id,))
-    conn.commit()
-
-def mark_job_failed(conn: sqlite3.Connection, job_id: int, err: str):
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE recompute_jobs
-        SET processed = 2, last_error = ?, processed_at = datetime('now'), processing = 0
-        WHERE id = ?;
-    """, (err, job_id))
-    conn.commit()
+        Queue audit rows for `changed`; returns the entries that did not fit (queue full,
+        or the writer thread is not running), which the caller writes itself.
+        """
+        if not self._thread.is_alive():
+            return list(changed)
+        for i, (uid, score, details) in enumerate(changed):
+            try:
+                self._q.put_nowait((uid, score, details, now))
+            except queue.Full:
+                return list(changed[i:])
+        return []
+
+    def close(self):
+        # the sentinel queues behind every pending row, so this flushes before stopping;
+        # a dead thread never drains the queue, so don't wait on it
+        if not self._thread.is_alive():
+            if self._q.qsize():
+                logger.error("[audit-writer] thread is not running — %d queued audit row(s) lost", self._q.qsize())
+            return
+        try:
+            self._q.put(None, timeout=AUDIT_CLOSE_TIMEOUT)
+        except queue.Full:
+            logger.error("[audit-writer] queue still full after %ss — %d queued audit row(s) lost",
+                         AUDIT_CLOSE_TIMEOUT, self._q.qsize())
+            return
+        self._thread.join()
+
+    def _run(self, db_path: str):
+        conn = None
+        try:
+            conn = sqlite3.connect(db_path, timeout=0, isolation_level=None, cached_statements=CACHED_STATEMENTS)
+            conn.executescript(PRAGMAS)
+        except Exception as e:
+            # submit() sees the thread is gone and hands every row back for inline writes
+            logger.exception("[audit-writer] cannot open %s, audit rows will be written inline: %s", db_path, e)
+            if conn is not None:
+                conn.close()
+            return
+        try:
+            stop = False
+            while not stop:
+                item = self._q.get()
+                if item is None:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+                while len(batch) < AUDIT_FLUSH_ROWS:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._q.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._write(conn, batch)
+        finally:
+            conn.close()
+
+    def _write(self, conn: sqlite3.Connection, batch: List[Tuple[str, float, Any, str]]):
+        try:
+            rows = [(uid, score, *_audit_details(trust_breakdown(*details)), now) for uid, score, details, now in batch]
+            conn.execute("BEGIN IMMEDIATE;")
+            conn.executemany(_SQL_AUDIT, rows)
+            conn.commit()
+        except Exception as e:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            logger.exception("[audit-writer] failed to write %d audit row(s): %s", len(batch), e)
+
+def mark_jobs_done(conn: sqlite3.Connection, job_ids: Sequence[int], now_unix: int) -> List[int]:
+    """
+    Mark `job_ids` done and return each job's enqueue-to-done latency in seconds. Jobs
+    deleted since they were claimed (ON DELETE CASCADE from their user) are skipped.
+    """
+    # one execute per row (executemany discards RETURNING rows)
+    rows = [conn.execute(_SQL_MARK_DONE, (now_unix, job_id)).fetchone() for job_id in job_ids]
+    return [row[0] for row in rows if row is not None]
+
+def mark_jobs_failed(conn: sqlite3.Connection, failures: Sequence[Tuple[int, str]], now_unix: int):
+    """
+    `failures` is (job_id, error message) per failed job.
+    """
+    conn.executemany(_SQL_MARK_FAIL, [(err, now_unix, job_id) for job_id, err in failures])
+
+def finalize_jobs(conn: sqlite3.Connection, scored: Sequence[Tuple[str, float, Any]],
+                  done_ids: Sequence[int], failures: Sequence[Tuple[int, str]] = (),
+                  audit_writer: Optional[AuditWriter] = None) -> List[int]:
+    """
+    Persist a claimed batch in one transaction: scores for `scored`, the done marker for
+    `done_ids` and the failed marker for `failures`. Audit rows for changed scores go in
+    the same transaction, or — with `audit_writer` — to its queue once the batch has
+    committed (inline, in their own transaction, if the queue is full or the writer has
+    stopped; a failure there is logged, not raised).
+    Returns the enqueue-to-done latency (seconds) of each job in `done_ids`.
+    """
+    t = time.time()
+    now, now_unix = _now(t), int(t)
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        changed = upsert_trust_scores(conn, scored, now)
+        if audit_writer is None:
+            insert_audits(conn, changed, now)
+        latencies = mark_jobs_done(conn, done_ids, now_unix)
+        mark_jobs_failed(conn, failures, now_unix)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if audit_writer is not None and changed:
+        overflow = audit_writer.submit(changed, now)
+        if overflow:
+            logger.debug("[worker_debug] audit queue full or writer stopped — writing %d audit row(s) inline", len(overflow))
+            # the batch has committed: a failure here must not reach worker_loop, which
+            # would mark the already-done jobs failed
+            try:
+                conn.execute("BEGIN IMMEDIATE;")
+                insert_audits(conn, overflow, now)
+                conn.commit()
+            except Exception as e:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                logger.exception("[worker_debug] failed to write %d overflow audit row(s): %s", len(overflow), e)
+    return latencies
+
+def open_reader(db_path: str = DB_FILE) -> sqlite3.Connection:
+    """
+    Read-only connection to `db_path` for the worker's user fetches.
+    """
+    uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+    conn_r = sqlite3.connect(uri, uri=True, timeout=0, isolation_level=None, cached_statements=CACHED_STATEMENTS)
+    conn_r.executescript(READER_PRAGMAS)
+    return conn_r
+
+def process_batch(conn: sqlite3.Connection, jobs: List[Dict[str, Any]], conn_r: Optional[sqlite3.Connection] = None,
+                  audit_writer: Optional[AuditWriter] = None):
+    """
+    Compute every claimed job in `jobs` and persist the whole batch with finalize_jobs().
+    A job whose compute raises is marked failed without affecting the rest of the batch.
+    Users are read through `conn_r` when given (see open_reader), else through `conn`.
+    """
+    rows = fetch_user_rows(conn_r or conn, [job["user_id"] for job in jobs])
+    scored, done_ids, failures, finished = [], [], [], []
+    for job in jobs:
+        job_id = job["id"]
+        user_id = job["user_id"]
+        logger.info("[worker_debug] claimed job_id=%s user_id=%s attempts=%s", job_id, user_id, job.get("attempts"))
+        row = rows.get(user_id)
+        logger.debug("[worker_debug] fetched user: %s", row)
+        if row is None:
+            logger.info("[worker_debug] user missing — marking job done %s", user_id)
+            done_ids.append(job_id)
+            continue
+        try:
+            final_score, parts = compute_trust_score_arr(*row[1:])
+            logger.debug("[worker_debug] computed final_score: %s", final_score)
+        except Exception as e:
+            logger.exception("[worker_debug] error processing job %s: %s", job_id, e)
+            failures.append((job_id, str(e)))
+            continue
+        scored.append((user_id, final_score, (parts, row[9])))
+        done_ids.append(job_id)
+        finished.append((job_id, user_id, final_score))
+
+    # Persist (scores, audits and job markers for the whole batch commit together)
+    latencies = finalize_jobs(conn, scored, done_ids, failures, audit_writer)
+    for job_id, user_id, final_score in finished:
+        logger.info("[worker_debug] DONE job=%s user=%s score=%s", job_id, user_id, final_score)
+    if latencies:
+        logger.info("[worker_debug] batch: %d done, %d failed; enqueue-to-done latency max=%ss avg=%.1fs",
+                    len(latencies), len(failures), max(latencies), sum(latencies) / len(latencies))
 
 def worker_loop(worker_name: str):
-    log("[worker_debug] starting", worker_name)
-    log("cwd:", os.getcwd())
-    log("db path:", DB_FILE)
-    conn = sqlite3.connect(DB_FILE, timeout=CLAIM_TIMEOUT, isolation_level=None)
-    conn.execute("PRAGMA foreign_keys = ON;")
+    logger.info("[worker_debug] starting %s", worker_name)
+    logger.info("cwd: %s", os.getcwd())
+    logger.info("db path: %s", DB_FILE)
+    # timeout=0: lock waits are handled by PRAGMA busy_timeout inside SQLite
+    conn = sqlite3.connect(DB_FILE, timeout=0, isolation_level=None, cached_statements=CACHED_STATEMENTS)
+    conn.executescript(PRAGMAS)
+    # 0x10002: analyze any table that needs it (with the 0x10000 "check every table"
+    # bit, as recommended for long-lived connections) before the first claim
+    conn.execute("PRAGMA optimize = 0x10002;")
+    # opened after the writer so the DB is already in WAL mode (a read-only
+    # connection can't switch it)
+    conn_r = open_reader(DB_FILE)
+    audit_writer = AuditWriter(DB_FILE)
+    fifo = open_notify_fifo(notify_path(DB_FILE))
+    logger.info("notify fifo: %s", notify_path(DB_FILE) if fifo else "(unavailable — timed polling)")
+    last_checkpoint = last_optimize = time.monotonic()
     try:
         while True:
-            job = claim_job(conn, worker_name)
-            if job is None:
-                # print a small heartbeat so we know worker is alive
-                log("[worker_debug] no job — sleeping", POLL_INTERVAL)
-                time.sleep(POLL_INTERVAL)
+            jobs = claim_jobs(conn, worker_name)
+            if not jobs:
+                # small heartbeat (DEBUG) so we know worker is alive
+                logger.debug("[worker_debug] no job — waiting up to %s", POLL_INTERVAL)
+                if time.monotonic() - last_checkpoint > CHECKPOINT_INTERVAL:
+                    # queue is empty: fold the WAL back into the DB and truncate it now,
+                    # rather than letting an autocheckpoint land in the middle of a batch
+                    busy, wal_pages, moved = conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()
+                    logger.debug("[worker_debug] wal_checkpoint busy=%s wal_pages=%s checkpointed=%s", busy, wal_pages, moved)
+                    last_checkpoint = time.monotonic()
+                if time.monotonic() - last_optimize > OPTIMIZE_INTERVAL:
+                    conn.execute("PRAGMA optimize;")
+                    last_optimize = time.monotonic()
+                wait_for_jobs(fifo, POLL_INTERVAL)
                 continue
-            job_id = job["id"]
-            user_id = job["user_id"]
-            log(f"[worker_debug] claimed job_id={job_id} user_id={user_id} attempts={job.get('attempts')}")
             try:
-                user = fetch_user_as_dict(conn, user_id)
-                log("[worker_debug] fetched user:", user)
-                if user is None:
-                    log("[worker_debug] user missing — marking job done", user_id)
-                    mark_job_done(conn, job_id)
-                    continue
-
-                # Call your compute function
-                try:
-                    score_result = compute_trust_score(user)
-                    log("[worker_debug] compute_trust_score returned type:", type(score_result))
-                    try:
-                        # Try to extract final_score and details generously
-                        final_score = None
-                        details_obj = None
-                        if isinstance(score_result, dict):
-                            final_score = score_result.get("final_score") or score_result.get("finalScore") or score_result.get("final")
-                            details_obj = score_result.get("breakdown") or score_result
-                        else:
-                            final_score = getattr(score_result, "final_score", None) or getattr(score_result, "finalScore", None) or getattr(score_result, "final", None)
-                            details_obj = getattr(score_result, "breakdown", None) or getattr(score_result, "__dict__", score_result)
-                        log("[worker_debug] extracted final_score:", final_score)
-                    except Exception as e:
-                        log("[worker_debug] error extracting fields from score_result:", e)
-                        raise
-                except Exception as e:
-                    log("[worker_debug] compute_trust_score raised exception:", e)
-                    raise
-
-                if final_score is None:
-                    raise RuntimeError(f"final_score is None — compute_trust_score returned: {score_result!r}")
-
-                # Persist
-                upsert_trust_score_and_audit(conn, user_id, float(final_score), details_obj)
-                mark_job_done(conn, job_id)
-                log(f"[worker_debug] DONE job={job_id} user={user_id} score={final_score}")
+                process_batch(conn, jobs, conn_r, audit_writer)
             except Exception as e:
-                tb = traceback.format_exc()
-                log(f"[worker_debug] error processing job {job_id}: {e}\n{tb}")
+                logger.exception("[worker_debug] error processing batch of %d job(s): %s", len(jobs), e)
                 try:
-                    mark_job_failed(conn, job_id, str(e))
+                    finalize_jobs(conn, (), (), [(job["id"], str(e)) for job in jobs])
                 except Exception as ee:
-                    log("[worker_debug] failed to mark job failed:", ee)
+                    logger.error("[worker_debug] failed to mark jobs failed: %s", ee)
     finally:
+        audit_writer.close()
+        if fifo:
+            for fd in fifo:
+                os.close(fd)
+        try:
+            conn.execute("PRAGMA optimize;")
+        except sqlite3.Error:
+            pass
+        conn_r.close()
         conn.close()
 
 if __name__ == "__main__":
-    name = f"{socket.gethostname()}-{os.getpid()}"
-    worker_loop(name)
+    logging.basicConfig(level=os.environ.get("WORKER_LOG", "INFO").upper(), format="%(asctime)s %(message)s")
+    # built once; the same interned str object is bound as `processor` on every claim
+    WORKER_NAME = sys.intern(f"{socket.gethostname()}-{os.getpid()}")
+    worker_loop(WORKER_NAME)